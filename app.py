@@ -2,9 +2,20 @@ import streamlit as st
 import os
 import shutil
 from PIL import Image
-import tempfile
-from video_processor import render_video
+import numpy as np
+import uuid
 from utils import hex_to_rgb
+from frame_cache import DEFAULT_CACHE_DIR
+from preview import render_preview, render_preview_strip
+from ingest import ingest_image, ensure_media
+from blob_store import BlobStore, find_near_duplicates
+from render_jobs import get_job_manager, ACTIVE_STATES
+from workspace import Workspace, QuotaExceeded, DEFAULT_WORKSPACE_ROOT, maybe_sweep, cached_dir_size
+from profiling import load_trace, summarize, trace_path_for
+from project_io import bundle_project, snapshot
+from audio_processor import audio_duration, waveform_overview, DEFAULT_FADE_OUT, DEFAULT_AUDIO_CACHE_DIR
+from segment_encoder import ENCODER_PROFILES, DEFAULT_ENCODER_PROFILE, encoder_threads
+from transitions import TRANSITION_TYPES, SLIDE_DIRECTIONS, DEFAULT_TRANSITION_DURATION, MAX_KEN_BURNS_ZOOM, timeline_duration
 
 # Page Config
 st.set_page_config(
@@ -17,32 +28,115 @@ st.set_page_config(
 # --- State Management ---
 if 'project' not in st.session_state:
     st.session_state.project = {
-        'images': [], # List of dicts: {path, id, filters: {}, duration: 3, text_overlay: {}}
+        'images': [], # List of dicts: {path, id, filters: {}, duration: 3, text_overlay: {}, media: {}}
         'audio': {},  # {path, volume, start, end, loop}
         'settings': {
             'resolution': (1080, 1920), # Default 9:16
             'fps': 30,
             'bg_color': '#000000',
-            'fit_method': 'contain'
+            'fit_method': 'contain',
+            'render_mode': 'segments',
+            'encoder_profile': DEFAULT_ENCODER_PROFILE
         }
     }
 
-if 'temp_global_dir' not in st.session_state:
-    st.session_state.temp_global_dir = tempfile.mkdtemp()
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
-# Cleanup on exit (not perfect in Streamlit but good practice)
-# We won't implement complex cleanup hooks here to keep it simple.
+# Uploads, proxies, segments and renders live in a per-session workspace with a
+# disk quota; files nothing references any more are deleted on the next rerun and
+# abandoned sessions are swept after a TTL (see workspace.py).
+if 'workspace' not in st.session_state:
+    st.session_state.workspace = Workspace(DEFAULT_WORKSPACE_ROOT, st.session_state.session_id)
+
+def workspace():
+    return st.session_state.workspace
+
+def upload_store():
+    """Content-addressed store for this session's uploads (see blob_store.py)."""
+    return BlobStore(workspace().path('uploads'))
 
 def save_uploaded_file(uploaded_file):
+    """Stores an upload by content hash. Returns (digest, path), or None on failure."""
     try:
-        path = os.path.join(st.session_state.temp_global_dir, uploaded_file.name)
-        with open(path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return path
+        digest, path, _ = upload_store().put(uploaded_file.getbuffer(), uploaded_file.name,
+                                             reserve=workspace().ensure_space)
+        # Held until the next rerun has it on the timeline, so making room for
+        # the rest of a multi-file upload cannot collect it
+        workspace().add_ref('pending', path)
+        return digest, path
+    except QuotaExceeded as e:
+        st.error(f"Could not add {uploaded_file.name}: {e}")
+        return None
     except Exception as e:
         st.error(f"Error saving file: {e}")
         return None
 
+def slide_name(img_data):
+    """Name to show for a slide: the uploaded file name (stored files are named by digest)."""
+    return img_data.get('name') or os.path.basename(img_data['path'])
+
+def waveform_image(path, start, end, duration, height=80):
+    """Waveform overview with the trimmed-out parts dimmed."""
+    peaks = waveform_overview(path)
+    width = len(peaks)
+    rows = np.arange(height)[:, None]
+    half = (peaks * (height / 2 - 1)).astype(int)[None, :]
+    wave_mask = np.abs(rows - height // 2) <= half
+
+    img = np.full((height, width, 3), 30, dtype=np.uint8)
+    cols = np.arange(width) * duration / width
+    kept = (cols >= start) & (cols <= end)
+    img[wave_mask & kept[None, :]] = (255, 75, 75)
+    img[wave_mask & ~kept[None, :]] = (90, 90, 90)
+    return Image.fromarray(img)
+
+def derived_dir():
+    """Where thumbnails and preview proxies for this session live."""
+    return workspace().path('derived')
+
+def render_files(output_path):
+    """Files a render writes: the reel and its timing trace."""
+    return [output_path, trace_path_for(output_path)]
+
+def sync_workspace():
+    """
+    Declares which uploads and renders the session still uses, deletes the
+    rest and sweeps abandoned sessions. Runs at the top of every rerun, before
+    new uploads are stored.
+    """
+    ws = workspace()
+    ws.touch()
+    project = st.session_state.project
+
+    # Files of a session left idle past the TTL are gone
+    missing = [img for img in project['images'] if not os.path.exists(img['path'])]
+    if missing:
+        project['images'] = [img for img in project['images'] if img not in missing]
+        st.warning(f"{len(missing)} slide(s) expired from storage and were removed. Upload them again.")
+    if project['audio'].get('path') and not os.path.exists(project['audio']['path']):
+        project['audio'] = {}
+
+    ws.set_refs('timeline', [img['path'] for img in project['images']])
+    ws.set_refs('audio', [project['audio'].get('path')])
+    ws.release('pending')
+
+    # Queued and running renders hold their sources and output until they finish
+    manager = get_job_manager()
+    for owner in ws.owners():
+        if owner.startswith('job:'):
+            job = manager.status(owner[len('job:'):])
+            if job is None or job['status'] not in ACTIVE_STATES:
+                ws.release(owner)
+    # Only the latest render is kept
+    job_id = st.session_state.get('render_job_id')
+    job = manager.status(job_id) if job_id else None
+    ws.set_refs('result', render_files(job['output_path']) if job else [])
+    ws.collect()
+
+    busy_sessions = {j['owner'] for j in manager.list_jobs() if j['status'] in ACTIVE_STATES}
+    maybe_sweep(keep=busy_sessions | {st.session_state.session_id})
+
 # --- UI Components ---
 def sidebar_settings():
     st.sidebar.title("⚙️ Global Settings")
@@ -72,19 +166,70 @@ def sidebar_settings():
         "Image Fit", ['contain', 'cover', 'stretch'],
         help="'Contain' adds padding. 'Cover' crops the image. 'Stretch' distorts it."
     )
-    
+
+    # Render Mode
+    render_modes = {
+        "Fast (static segments)": 'segments',
+        "Streaming (single pass)": 'stream',
+        "Classic (MoviePy compose)": 'compose'
+    }
+    mode_name = st.sidebar.selectbox(
+        "Render Mode", list(render_modes.keys()),
+        help="Fast mode encodes each still slide once and joins the segments without re-encoding. "
+             "Streaming pipes frames into one encoder with constant memory."
+    )
+    st.session_state.project['settings']['render_mode'] = render_modes[mode_name]
+
+    # Encoder Profile
+    profile_names = list(ENCODER_PROFILES.keys())
+    profile = st.sidebar.selectbox(
+        "Encoder Profile", profile_names,
+        index=profile_names.index(st.session_state.project['settings'].get('encoder_profile', DEFAULT_ENCODER_PROFILE)),
+        format_func=lambda name: ENCODER_PROFILES[name]['label'],
+        help="Draft encodes fastest; Social gives upload-sized files; Archive keeps the most detail."
+    )
+    st.session_state.project['settings']['encoder_profile'] = profile
+    expected = ENCODER_PROFILES[profile]['expected']
+    encode_fps = expected['fps_per_thread'] * encoder_threads()
+    st.sidebar.caption(
+        f"Expected: ~{encode_fps:.0f} fps encode on this machine "
+        f"({encode_fps / st.session_state.project['settings']['fps']:.1f}x realtime), ~{expected['kbps'] / 1000:.1f} Mbps"
+    )
+
+    # Parallel slide preparation
+    cores = os.cpu_count() or 1
+    st.session_state.project['settings']['workers'] = st.sidebar.number_input(
+        "Worker Processes", 1, cores, cores,
+        help="Slides are filtered and resized in parallel before encoding."
+    )
+
     st.sidebar.markdown("---")
-    st.sidebar.info(f"Memory Usage: Optimized for 16GB RAM\nCurrent Images: {len(st.session_state.project['images'])}")
+    usage = workspace().usage()
+    mb = 1024 ** 2
+    st.sidebar.progress(
+        min(1.0, usage['total'] / usage['quota']),
+        text=f"Disk: {usage['total'] / mb:.0f} MB of {usage['quota'] / mb:.0f} MB"
+    )
+    st.sidebar.caption(
+        f"Uploads {usage['uploads'] / mb:.0f} MB · Proxies {usage['derived'] / mb:.0f} MB · "
+        f"Segments {usage['segments'] / mb:.0f} MB · Renders {usage['renders'] / mb:.0f} MB\n\n"
+        f"Shared caches: frames {cached_dir_size(DEFAULT_CACHE_DIR) / mb:.0f} MB, "
+        f"audio {cached_dir_size(DEFAULT_AUDIO_CACHE_DIR) / mb:.0f} MB · "
+        f"Current Images: {len(st.session_state.project['images'])}"
+    )
 
 def image_editor_ui(idx, img_data):
     """Controls for a single image"""
     
     # Thumbnail and basic info
+    media = ensure_media(img_data, derived_dir())
     col1, col2 = st.columns([1, 3])
     with col1:
-        st.image(img_data['path'], width=100)
+        # Small ingest-time thumbnail instead of the multi-megabyte original
+        st.image(media['thumb_path'], width=100)
     with col2:
-        st.markdown(f"**Image {idx + 1}**: `{os.path.basename(img_data['path'])}`")
+        st.markdown(f"**Image {idx + 1}**: `{slide_name(img_data)}`")
+        st.caption(f"{media['width']}x{media['height']} {media['format'] or ''} · {media['bytes'] / 1024**2:.1f} MB")
         
         # Duration
         img_data['duration'] = st.slider(
@@ -93,7 +238,7 @@ def image_editor_ui(idx, img_data):
         )
     
     # Tabs for Editing
-    tab_filters, tab_text, tab_transform = st.tabs(["🎨 Filters", "📝 Text", "📐 Transform"])
+    tab_filters, tab_text, tab_transform, tab_motion = st.tabs(["🎨 Filters", "📝 Text", "📐 Transform", "🎬 Motion"])
     
     with tab_filters:
         c1, c2, c3 = st.columns(3)
@@ -147,9 +292,106 @@ def image_editor_ui(idx, img_data):
         rot = st.selectbox("Rotate", [0, 90, 180, 270], key=f"rot_{idx}")
         img_data['filters']['rotate'] = rot
 
+    with tab_motion:
+        if idx > 0:
+            kind = st.selectbox("Transition from previous slide", list(TRANSITION_TYPES), key=f"trtype_{idx}")
+            img_data['transition'] = {'type': kind}
+            if kind != 'none':
+                c_tr1, c_tr2 = st.columns(2)
+                with c_tr1:
+                    img_data['transition']['duration'] = st.slider(
+                        "Transition (sec)", 0.1, 2.0, DEFAULT_TRANSITION_DURATION, 0.1, key=f"trdur_{idx}")
+                if kind == 'slide':
+                    with c_tr2:
+                        img_data['transition']['direction'] = st.selectbox("Direction", list(SLIDE_DIRECTIONS), key=f"trdir_{idx}")
+        if st.checkbox("Ken Burns (pan & zoom)", key=f"kb_{idx}"):
+            st.caption("Pan is -1 (left/top) to 1 (right/bottom) within the room the zoom leaves.")
+            motion = {'type': 'kenburns'}
+            for col, end, default_zoom in zip(st.columns(2), ('start', 'end'), (1.0, 1.2)):
+                with col:
+                    st.markdown(f"**{end.title()}**")
+                    motion[f'zoom_{end}'] = st.slider("Zoom", 1.0, MAX_KEN_BURNS_ZOOM, default_zoom, 0.05, key=f"kbz{end}_{idx}")
+                    motion[f'x_{end}'] = st.slider("Pan horizontal", -1.0, 1.0, 0.0, 0.1, key=f"kbx{end}_{idx}")
+                    motion[f'y_{end}'] = st.slider("Pan vertical", -1.0, 1.0, 0.0, 0.1, key=f"kby{end}_{idx}")
+            img_data['motion'] = motion
+        else:
+            img_data.pop('motion', None)
+
+    # Live preview at proxy resolution, reflecting the controls above
+    if st.checkbox("👁️ Live Preview", value=True, key=f"prev_{idx}"):
+        try:
+            st.image(render_preview(img_data, st.session_state.project['settings']), caption="Preview")
+        except Exception as e:
+            st.warning(f"Preview unavailable: {e}")
+
+@st.fragment(run_every=1.0)
+def render_job_progress(job_id):
+    """Polls a queued/running render job; only this fragment reruns while the job is active."""
+    manager = get_job_manager()
+    job = manager.status(job_id)
+    if job is None or job['status'] not in ACTIVE_STATES:
+        st.rerun() # finished: redraw the whole page with the result
+        return
+
+    if job['status'] == 'queued':
+        st.info(f"Queued (position {job.get('queue_position', 1)})... other exports are running on this server.")
+    else:
+        st.progress(min(job['progress'], 1.0), text=f"Rendering... {job['progress'] * 100:.0f}%")
+    if st.button("✖️ Cancel Render", key=f"cancel_{job_id}"):
+        manager.cancel(job_id)
+
+def render_job_result(job):
+    """Shows the outcome of the session's last render job."""
+    if job['status'] == 'cancelled':
+        st.info("Render cancelled.")
+        return
+    if job['status'] == 'failed':
+        st.error(f"Rendering failed: {job['error'].splitlines()[0] if job['error'] else 'unknown error'}")
+        with st.expander("Details"):
+            st.code(job['error'])
+        return
+
+    result_path = job['output_path']
+    if not os.path.exists(result_path):
+        st.warning("The rendered file is no longer available. Render again.")
+        return
+
+    st.success(f"Rendering Complete! ({job['finished'] - job['started']:.1f}s)")
+
+    segments = job['stats'].get('segments')
+    if segments:
+        st.caption(f"Segments: {segments.get('encoded', 0)} encoded, {segments.get('reused', 0)} reused")
+        # Counted by the pool workers that prepared the slides
+        cache_stats = segments.get('frame_cache')
+        if cache_stats:
+            st.caption(f"Frame cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+
+    st.video(result_path)
+
+    with open(result_path, "rb") as f:
+        st.download_button(
+            "⬇️ Download Reel",
+            f,
+            "my_reel.mp4",
+            "video/mp4"
+        )
+
+    trace_path = job['stats'].get('trace_path')
+    if trace_path and os.path.exists(trace_path):
+        with st.expander("⏱️ Timing Summary", expanded=True):
+            st.caption("Inclusive time per stage, summed over slides (pool workers run in parallel).")
+            st.dataframe(
+                [{'Stage': r['name'], 'Calls': r['count'], 'Total ms': r['total_ms'], 'Mean ms': r['mean_ms'], 'Max ms': r['max_ms']}
+                 for r in summarize(load_trace(trace_path))],
+                hide_index=True
+            )
+            with open(trace_path, "rb") as f:
+                st.download_button("⬇️ Download Trace (chrome://tracing)", f, "render_trace.json", "application/json")
+
 def main():
     st.title("🎬 Streamlit Reel Editor")
-    
+
+    sync_workspace()
     sidebar_settings()
     
     tab_editor, tab_audio, tab_export = st.tabs(["🖼️ Timeline Editor", "🎵 Audio", "📤 Export & Preview"])
@@ -158,24 +400,35 @@ def main():
     with tab_editor:
         uploaded_files = st.file_uploader("Add Images", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True)
         if uploaded_files:
+            images = st.session_state.project['images']
+            handled = st.session_state.setdefault('handled_uploads', set())
             for uf in uploaded_files:
-                # check if already added to avoid duplicates on rerun
-                # (Simple check by filename match in this session)
-                is_new = True
-                for img in st.session_state.project['images']:
-                    if os.path.basename(img['path']) == uf.name:
-                        is_new = False
-                        break
-                
-                if is_new:
-                    path = save_uploaded_file(uf)
-                    if path:
-                        st.session_state.project['images'].append({
-                            'path': path,
-                            'filters': {},
-                            'duration': 3.0,
-                            'text_overlay': {}
-                        })
+                # The uploader hands back every file on each rerun; take each upload once
+                if uf.file_id in handled:
+                    continue
+                handled.add(uf.file_id)
+
+                saved = save_uploaded_file(uf)
+                if not saved:
+                    continue
+                digest, path = saved
+                duplicate = next((i for i, img in enumerate(images) if img.get('media', {}).get('digest') == digest), None)
+                if duplicate is not None:
+                    st.toast(f"{uf.name} is already on the timeline (Frame {duplicate + 1}); skipped.")
+                    continue
+                try:
+                    media = ingest_image(path, derived_dir())
+                except Exception as e:
+                    st.error(f"Could not read {uf.name}: {e}")
+                    continue
+                images.append({
+                    'path': path,
+                    'name': uf.name,
+                    'filters': {},
+                    'duration': 3.0,
+                    'text_overlay': {},
+                    'media': media
+                })
             # Clear uploader logic is tricky in Streamlit, usually we just ignore
             
         st.subheader("Timeline")
@@ -185,8 +438,24 @@ def main():
         else:
             # Reorder controls
             
+            images = st.session_state.project['images']
+            if st.checkbox("🎞️ Timeline Preview", key="timeline_preview"):
+                strip_len = min(6, len(images))
+                start = 0
+                if len(images) > strip_len:
+                    start = st.slider("Start at frame", 1, len(images) - strip_len + 1, 1) - 1
+                strip = render_preview_strip(images, st.session_state.project['settings'], start, strip_len)
+                st.image(strip, width=120, caption=[f"Frame {start + i + 1}" for i in range(len(strip))])
+
+            near_duplicates = {}
+            if st.checkbox("🔍 Flag near-duplicates", value=True, key="flag_near_duplicates"):
+                near_duplicates = find_near_duplicates([img.get('media', {}).get('dhash') for img in images])
+
             for i, img_data in enumerate(st.session_state.project['images']):
-                with st.expander(f"Frame {i+1}: {os.path.basename(img_data['path'])}", expanded=False):
+                label = f"Frame {i+1}: {slide_name(img_data)}"
+                if i in near_duplicates:
+                    label += f" ⚠️ looks like Frame {near_duplicates[i][0] + 1}"
+                with st.expander(label, expanded=False):
                     image_editor_ui(i, img_data)
                     if st.button(f"Remove Frame {i+1}", key=f"rem_{i}"):
                         st.session_state.project['images'].pop(i)
@@ -196,55 +465,95 @@ def main():
     with tab_audio:
         st.header("Audio Settings")
         audio_file = st.file_uploader("Upload Background Music", type=['mp3', 'wav'])
+        audio = st.session_state.project['audio']
         if audio_file:
-            path = save_uploaded_file(audio_file)
-            st.session_state.project['audio']['path'] = path
-            st.success(f"Loaded: {audio_file.name}")
+            saved = save_uploaded_file(audio_file)
+            if saved:
+                path = saved[1]
+                if path != audio.get('path'):
+                    # New track: drop the old trim
+                    audio.pop('start_time', None)
+                    audio.pop('end_time', None)
+                audio['path'] = path
+                st.success(f"Loaded: {audio_file.name}")
         
-        if st.session_state.project['audio'].get('path'):
-            st.audio(st.session_state.project['audio']['path'])
-            c1, c2 = st.columns(2)
+        if audio.get('path'):
+            st.audio(audio['path'])
+
+            try:
+                duration = audio_duration(audio['path'])
+            except IOError as e:
+                st.error(str(e))
+                duration = 0
+
+            if duration > 0:
+                start, end = st.slider(
+                    "Trim (seconds)", 0.0, round(duration, 1),
+                    (float(audio.get('start_time') or 0.0), float(audio.get('end_time') or round(duration, 1))),
+                    step=0.1
+                )
+                audio['start_time'] = start
+                audio['end_time'] = end if end < round(duration, 1) else None
+                st.image(waveform_image(audio['path'], start, end, duration), width='stretch')
+                st.caption(f"Using {end - start:.1f}s of {duration:.1f}s")
+
+            c1, c2, c3 = st.columns(3)
             with c1:
-                st.session_state.project['audio']['volume'] = st.slider("Volume", 0.0, 2.0, 1.0)
+                audio['volume'] = st.slider("Volume", 0.0, 2.0, audio.get('volume', 1.0))
             with c2:
-                st.session_state.project['audio']['loop'] = st.checkbox("Loop Audio", value=True)
+                audio['loop'] = st.checkbox("Loop Audio", value=audio.get('loop', True))
+            with c3:
+                audio['fade_out'] = st.slider("Fade Out (s)", 0.0, 5.0, audio.get('fade_out', DEFAULT_FADE_OUT), step=0.5,
+                                              help="Fades the music out before the video ends.")
 
     # --- Tab 3: Export ---
     with tab_export:
         st.header("Render Reel")
-        
-        if st.button("🚀 Render Video"):
+
+        manager = get_job_manager()
+        job_id = st.session_state.get('render_job_id')
+        job = manager.status(job_id) if job_id else None
+        busy = job is not None and job['status'] in ACTIVE_STATES
+
+        profile = st.checkbox("⏱️ Timing Profile", value=False,
+                              help="Record how long each render stage takes (decode, filters, resize, encode...)")
+
+        if st.button("🚀 Render Video", disabled=busy):
             if not st.session_state.project['images']:
                 st.error("Add images first!")
             else:
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
+                # Segments persist per session so re-exports only encode changed slides
+                project = dict(st.session_state.project)
+                project['settings'] = dict(project['settings'], segment_dir=workspace().path('segments'), profile=profile)
+                output_file = os.path.join(workspace().path('renders'), f"reel_{uuid.uuid4().hex[:8]}.mp4")
+                # Room for the segments and the joined reel, at the profile's expected bitrate
+                kbps = ENCODER_PROFILES[project['settings']['encoder_profile']]['expected']['kbps']
+                estimate = 2 * kbps * 1000 / 8 * timeline_duration(project['images'], project['settings']['fps'])
                 try:
-                    status_text.text("Rendering... This may take a moment.")
-                    
-                    output_file = os.path.join(st.session_state.temp_global_dir, "output_reel.mp4")
-                    
-                    def update_progress(p):
-                        progress_bar.progress(p)
-                    
-                    result_path = render_video(st.session_state.project, output_file, update_progress)
-                    
-                    progress_bar.progress(1.0)
-                    status_text.success("Rendering Complete!")
-                    
-                    st.video(result_path)
-                    
-                    with open(result_path, "rb") as f:
-                        st.download_button(
-                            "⬇️ Download Reel",
-                            f,
-                            "my_reel.mp4",
-                            "video/mp4"
-                        )
-                except Exception as e:
-                    status_text.error(f"Rendering failed: {str(e)}")
-                    st.exception(e)
+                    workspace().ensure_space(estimate)
+                except QuotaExceeded as e:
+                    st.error(str(e))
+                else:
+                    job_id = manager.submit(project, output_file, owner=st.session_state.session_id)
+                    workspace().set_refs(f"job:{job_id}", render_files(output_file)
+                                         + [img['path'] for img in project['images']] + [project['audio'].get('path')])
+                    st.session_state.render_job_id = job_id
+                    st.rerun()
+
+        # Zipped with its media: the session's own paths mean nothing outside this workspace.
+        # Built on click from a copy, since the callback runs off the script thread.
+        bundle = snapshot(st.session_state.project)
+        st.download_button(
+            "💾 Download Project Bundle", lambda: bundle_project(bundle), "reel_project.zip", "application/zip",
+            help="Project file plus its media. For headless batch rendering, unzip it and run: "
+                 "python render_cli.py reel_project/reel_project.json -o renders/"
+        )
+
+        if job is not None:
+            if busy:
+                render_job_progress(job_id)
+            else:
+                render_job_result(job)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import wave
+from functools import lru_cache
+import numpy as np
+from frame_cache import file_digest
+from segment_encoder import ffmpeg_binary
+from profiling import span
+
+DEFAULT_AUDIO_CACHE_DIR = os.path.join(tempfile.gettempdir(), "reel_editor_cache", "audio")
+SAMPLE_RATE = 44100
+CHANNELS = 2
+DEFAULT_FADE_OUT = 0.0 # seconds faded out before the video ends (opt-in, older projects had none)
+WAVEFORM_POINTS = 600
+DEFAULT_AUDIO_CACHE_MAX_BYTES = 1024 ** 3 # decoded songs and finished tracks kept on disk (shared)
+
+_decode_locks = {}
+_decode_locks_lock = threading.Lock()
+
+def _decode_lock(pcm_path):
+    """One lock per cached file: concurrent decodes of the same song wait, other songs do not."""
+    with _decode_locks_lock:
+        return _decode_locks.setdefault(pcm_path, threading.Lock())
+
+def _cache_dir(cache_dir=None):
+    cache_dir = cache_dir or DEFAULT_AUDIO_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+# Cache files a render or decode is using right now (path -> holders), which
+# eviction must not delete: renders in other sessions run concurrently
+_in_use = {}
+_in_use_lock = threading.Lock()
+
+def _hold(path):
+    with _in_use_lock:
+        _in_use[path] = _in_use.get(path, 0) + 1
+
+def release_audio_track(path):
+    """Lets eviction delete a track returned by prepare_audio_track again (once it is muxed)."""
+    with _in_use_lock:
+        if _in_use.get(path, 0) > 1:
+            _in_use[path] -= 1
+        else:
+            _in_use.pop(path, None)
+
+def evict_audio_cache(cache_dir=None, max_bytes=DEFAULT_AUDIO_CACHE_MAX_BYTES, keep=()):
+    """
+    Deletes the least recently used decodes and tracks until the audio cache
+    fits in max_bytes, like FrameCache.evict. Paths in keep, and files held
+    by a render or decode in this process, stay.
+    """
+    cache_dir = _cache_dir(cache_dir)
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".tmp"):
+            continue
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        with _in_use_lock:
+            if path in keep or path in _in_use:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+def _touch(path):
+    # Recency for evict_audio_cache
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+def decode_audio(path, cache_dir=None):
+    """
+    Decodes a music file once to raw 16-bit stereo PCM at SAMPLE_RATE, cached
+    on disk by content hash. Returns a read-only (samples, 2) int16 memory map.
+    """
+    cache_dir = _cache_dir(cache_dir)
+    pcm_path = os.path.join(cache_dir, f"{file_digest(path)}_{SAMPLE_RATE}.s16")
+
+    # Held until the memory map is open (after that, deleting the file is harmless)
+    _hold(pcm_path)
+    try:
+        return _decode_pcm(path, pcm_path, cache_dir)
+    finally:
+        release_audio_track(pcm_path)
+
+def _decode_pcm(path, pcm_path, cache_dir):
+    with _decode_lock(pcm_path):
+        if not os.path.exists(pcm_path):
+            tmp_path = f"{pcm_path}.{os.getpid()}.tmp"
+            cmd = [
+                ffmpeg_binary(), '-y', '-loglevel', 'error', '-i', path,
+                '-vn', '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE),
+                tmp_path
+            ]
+            with span('audio.decode', 'audio', path=os.path.basename(path)):
+                proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if proc.returncode != 0:
+                raise IOError(f"Could not decode {os.path.basename(path)}: {proc.stderr.decode(errors='replace').strip()}")
+            os.replace(tmp_path, pcm_path)
+            evict_audio_cache(cache_dir, keep={pcm_path})
+        else:
+            _touch(pcm_path)
+
+    if os.path.getsize(pcm_path) == 0:
+        return np.zeros((0, CHANNELS), dtype='<i2')
+    return np.memmap(pcm_path, dtype='<i2', mode='r').reshape(-1, CHANNELS)
+
+def audio_duration(path, cache_dir=None):
+    """Length of the decoded track in seconds."""
+    return len(decode_audio(path, cache_dir)) / SAMPLE_RATE
+
+def build_audio_track(audio_config, video_duration, cache_dir=None):
+    """
+    Applies the audio settings to the decoded PCM and returns float32
+    (samples, 2) in [-1, 1], at most video_duration long:
+        - start_time / end_time: trim (seconds; end_time None or 0 = to the end)
+        - loop: repeat the trimmed part until the video ends
+        - volume: gain
+        - fade_out: seconds of linear fade ending at the video end
+    """
+    pcm = decode_audio(audio_config['path'], cache_dir)
+    start = int(round((audio_config.get('start_time') or 0) * SAMPLE_RATE))
+    end = audio_config.get('end_time')
+    end = int(round(end * SAMPLE_RATE)) if end else len(pcm)
+    clip = pcm[min(start, len(pcm)):max(start, min(end, len(pcm)))]
+
+    total = int(round(video_duration * SAMPLE_RATE))
+    if len(clip) == 0 or total == 0:
+        return np.zeros((0, CHANNELS), dtype=np.float32)
+
+    if len(clip) < total and audio_config.get('loop'):
+        repeats = -(-total // len(clip))
+        clip = np.tile(clip, (repeats, 1))
+    clip = clip[:total]
+
+    track = clip.astype(np.float32) * (audio_config.get('volume', 1.0) / 32768.0)
+
+    fade = int(round(audio_config.get('fade_out', DEFAULT_FADE_OUT) * SAMPLE_RATE))
+    if fade > 0 and len(track) >= total:
+        # Only when the music is cut by the end of the video
+        fade = min(fade, len(track))
+        track[-fade:] *= np.linspace(1.0, 0.0, fade, dtype=np.float32)[:, None]
+
+    np.clip(track, -1.0, 1.0, out=track)
+    return track
+
+def write_wav(track, path):
+    """Writes float32 (samples, 2) audio as 16-bit PCM WAV."""
+    samples = np.round(track * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(CHANNELS)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+    return path
+
+def _track_key(audio_config, video_duration):
+    payload = {
+        'source': file_digest(audio_config['path']),
+        'start_time': audio_config.get('start_time') or 0,
+        'end_time': audio_config.get('end_time') or None,
+        'loop': bool(audio_config.get('loop')),
+        'volume': audio_config.get('volume', 1.0),
+        'fade_out': audio_config.get('fade_out', DEFAULT_FADE_OUT),
+        'duration': round(video_duration, 6),
+        'rate': SAMPLE_RATE,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def prepare_audio_track(audio_config, video_duration, cache_dir=None):
+    """
+    Returns the path of a WAV holding the finished music bed for a video of
+    video_duration seconds, or None when the track is empty. Cached by
+    source and settings, so unchanged audio is neither decoded nor rebuilt.
+    The WAV is kept from eviction until release_audio_track(path).
+    """
+    cache_dir = _cache_dir(cache_dir)
+    wav_path = os.path.join(cache_dir, f"track_{_track_key(audio_config, video_duration)}.wav")
+    _hold(wav_path)
+    try:
+        if os.path.exists(wav_path):
+            _touch(wav_path)
+            return wav_path
+
+        with span('audio.build', 'audio'):
+            track = build_audio_track(audio_config, video_duration, cache_dir)
+        if len(track) == 0:
+            release_audio_track(wav_path)
+            return None
+        tmp_path = f"{wav_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        write_wav(track, tmp_path)
+        os.replace(tmp_path, wav_path)
+        evict_audio_cache(cache_dir, keep={wav_path})
+        return wav_path
+    except BaseException:
+        release_audio_track(wav_path)
+        raise
+
+@lru_cache(maxsize=16)
+def _waveform(digest, path, points, cache_dir):
+    pcm = decode_audio(path, cache_dir)
+    if len(pcm) == 0:
+        return np.zeros(points, dtype=np.float32)
+    mono = np.abs(pcm.astype(np.float32).mean(axis=1)) / 32768.0
+    # Peak per bucket; the tail that does not fill a bucket is dropped
+    bucket = max(1, len(mono) // points)
+    usable = mono[:bucket * min(points, len(mono) // bucket)]
+    return usable.reshape(-1, bucket).max(axis=1)
+
+def waveform_overview(path, points=WAVEFORM_POINTS, cache_dir=None):
+    """Peak amplitude envelope (0..1) of the whole track in `points` buckets, cached per file content."""
+    return _waveform(file_digest(path), path, points, cache_dir)
@@ -0,0 +1,107 @@
+"""
+Benchmarks the fused apply_image_filters against the previous chain of
+PIL enhancer passes and checks that both produce the same image.
+
+    python benchmarks/bench_filters.py --megapixels 12 --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import apply_image_filters # noqa: E402
+
+# Max per-channel difference allowed between the two pipelines (8-bit levels)
+TOLERANCE = 2
+
+SCENARIOS = {
+    'brightness+contrast': {'brightness': 1.2, 'contrast': 1.3},
+    'all enhancers': {'brightness': 0.9, 'contrast': 1.2, 'saturation': 1.4, 'sharpness': 1.5},
+    'grade+effects': {'brightness': 1.1, 'contrast': 0.8, 'saturation': 0.7, 'grayscale': True, 'invert': True, 'sepia': True},
+    'sepia': {'sepia': True},
+    'posterize+solarize': {'contrast': 1.2, 'posterize': True, 'solarize': True},
+    'grade+blur': {'brightness': 1.2, 'saturation': 1.3, 'blur': 2.0},
+    'rotate+invert': {'rotate': 90, 'invert': True},
+}
+
+def legacy_apply_image_filters(image, filters):
+    """The pre-fusion pipeline: one full-image pass per enhancer."""
+    img = image.copy()
+    if filters.get('rotate'):
+        img = img.rotate(-filters['rotate'], expand=True)
+    if filters.get('brightness', 1.0) != 1.0:
+        img = ImageEnhance.Brightness(img).enhance(filters['brightness'])
+    if filters.get('contrast', 1.0) != 1.0:
+        img = ImageEnhance.Contrast(img).enhance(filters['contrast'])
+    if filters.get('saturation', 1.0) != 1.0:
+        img = ImageEnhance.Color(img).enhance(filters['saturation'])
+    if filters.get('sharpness', 1.0) != 1.0:
+        img = ImageEnhance.Sharpness(img).enhance(filters['sharpness'])
+    if filters.get('grayscale'):
+        img = ImageOps.grayscale(img).convert("RGB")
+    if filters.get('invert'):
+        img = ImageOps.invert(img)
+    if filters.get('sepia'):
+        sepia_filter = np.array([
+            [0.393, 0.769, 0.189],
+            [0.349, 0.686, 0.168],
+            [0.272, 0.534, 0.131]
+        ])
+        sepia_img = np.array(img).dot(sepia_filter.T)
+        sepia_img /= 255.0
+        sepia_img = np.clip(sepia_img, 0, 1) * 255
+        img = Image.fromarray(sepia_img.astype('uint8'))
+    if filters.get('blur', 0) > 0:
+        img = img.filter(ImageFilter.GaussianBlur(radius=filters['blur']))
+    if filters.get('posterize'):
+        img = ImageOps.posterize(img, filters.get('posterize_bits', 4))
+    if filters.get('solarize'):
+        img = ImageOps.solarize(img, filters.get('solarize_threshold', 128))
+    return img
+
+def synthetic_photo(megapixels, seed=0):
+    """Smooth gradients plus noise, closer to a photo than uniform noise."""
+    w = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    h = int(w * 3 / 4)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = np.stack([x / w, y / h, 1 - (x + y) / (w + h)], axis=-1) * 220
+    noise = rng.normal(0, 12, size=(h, w, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(base + noise + 15, 0, 255).astype(np.uint8))
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=float, default=12.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    img = synthetic_photo(args.megapixels)
+    print(f"Input: {img.size[0]}x{img.size[1]} ({args.megapixels:g} MP), best of {args.repeat}")
+    print(f"{'scenario':<22}{'legacy s':>10}{'fused s':>10}{'speedup':>9}{'max diff':>10}{'mean diff':>11}")
+
+    failed = False
+    for name, filters in SCENARIOS.items():
+        legacy_t, legacy = best_of(lambda: legacy_apply_image_filters(img, filters), args.repeat)
+        fused_t, fused = best_of(lambda: apply_image_filters(img, filters), args.repeat)
+        diff = np.abs(np.asarray(legacy, dtype=np.int16) - np.asarray(fused, dtype=np.int16))
+        failed |= int(diff.max()) > TOLERANCE
+        print(f"{name:<22}{legacy_t:>10.3f}{fused_t:>10.3f}{legacy_t / fused_t:>8.2f}x"
+              f"{int(diff.max()):>10}{diff.mean():>11.4f}")
+
+    if failed:
+        print(f"FAIL: output differs by more than {TOLERANCE} levels")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
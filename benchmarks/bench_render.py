@@ -0,0 +1,374 @@
+"""
+End-to-end render benchmark on a synthetic project.
+
+Generates N slides of a given size with a rotating mix of filters, captions
+and a background track, then times each stage in a fresh process:
+
+    filters       apply_image_filters on every decoded source
+    resize        resize_image_for_video on every decoded source
+    load          load_image_for_video (decode + downscale-first pipeline)
+    render_<mode> cold render_video (empty frame cache and segment store)
+    incremental   segments re-render after editing one slide
+    transitions   cold segments render with crossfades, slide transitions and
+                  Ken Burns moves on a rotating subset of slides (compare
+                  with render_segments for the cost of the transition engine)
+    profile_<name> encode only (warm frame cache) with an encoder profile,
+                  also reporting output bitrate and frames/s per x264 thread
+
+Each stage reports wall time, throughput (slides/s, or frames/s for
+renders) and peak RSS of the stage process and of its largest child
+(pool workers, ffmpeg; a forked child's peak includes what it inherited).
+Results are written as JSON; with --baseline, stages slower or bigger than
+the baseline by more than --threshold fail the run (exit code 1).
+
+    python benchmarks/bench_render.py --slides 12 --megapixels 12 --output bench.json
+    python benchmarks/bench_render.py --baseline bench.json --threshold 0.25
+    python benchmarks/bench_render.py --profiles draft,social,archive --skip filters,resize,load,incremental
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+from bench_filters import SCENARIOS, synthetic_photo # noqa: E402
+from segment_encoder import ENCODER_PROFILES # noqa: E402
+
+IMAGE_STAGES = ('filters', 'resize', 'load')
+RENDER_MODES = ('segments', 'stream', 'compose')
+
+def _peak_rss_mb(who):
+    if who == resource.RUSAGE_SELF:
+        # ru_maxrss survives exec, so a spawned process would report its parent's peak;
+        # VmHWM belongs to the new address space.
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+def write_tone(path, duration, rate=44100):
+    """Stereo 16-bit sine sweep, long enough to exercise trimming and muxing."""
+    t = np.arange(int(duration * rate)) / rate
+    tone = 0.3 * np.sin(2 * np.pi * (220 + 40 * t) * t)
+    samples = (np.stack([tone, tone], axis=1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.tobytes())
+
+def make_project(work_dir, slides, megapixels, duration, resolution, fps, text_every, audio):
+    """Writes synthetic JPEG sources (and a WAV) to work_dir and returns the project dict."""
+    scenarios = list(SCENARIOS.values())
+    images = []
+    for i in range(slides):
+        path = os.path.join(work_dir, f"slide_{i:03d}.jpg")
+        synthetic_photo(megapixels, seed=i).save(path, quality=90)
+        text_overlay = {}
+        if text_every and i % text_every == 0:
+            text_overlay = {'text': f"Slide {i + 1}", 'fontsize': 70, 'color': '#FFFFFF', 'align': 'bottom'}
+        images.append({
+            'path': path,
+            'filters': dict(scenarios[i % len(scenarios)]),
+            'duration': duration,
+            'text_overlay': text_overlay,
+            'transition': {'type': 'none'},
+        })
+
+    audio_config = {}
+    if audio:
+        audio_config = {'path': os.path.join(work_dir, "music.wav"), 'volume': 0.8, 'loop': True}
+        write_tone(audio_config['path'], duration * slides * 0.75) # shorter than the reel, so it loops
+
+    return {
+        'images': images,
+        'audio': audio_config,
+        'settings': {'resolution': resolution, 'fps': fps, 'fit_method': 'cover', 'bg_color': '#000000'},
+    }
+
+def _best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def _decoded_sources(project):
+    from PIL import Image
+    sources = []
+    for img_data in project['images']:
+        with Image.open(img_data['path']) as img:
+            sources.append(img.convert('RGB'))
+    return sources
+
+def stage_filters(project, repeat):
+    from utils import apply_image_filters
+    sources = _decoded_sources(project)
+    def run():
+        for img, img_data in zip(sources, project['images']):
+            apply_image_filters(img, img_data['filters'])
+    return _best_of(run, repeat), len(sources), 'slides'
+
+def stage_resize(project, repeat):
+    from utils import hex_to_rgb, resize_image_for_video
+    settings = project['settings']
+    sources = _decoded_sources(project)
+    def run():
+        for img in sources:
+            resize_image_for_video(img, settings['resolution'], settings['fit_method'], hex_to_rgb(settings['bg_color']))
+    return _best_of(run, repeat), len(sources), 'slides'
+
+def stage_load(project, repeat):
+    from utils import hex_to_rgb, load_image_for_video
+    settings = project['settings']
+    def run():
+        for img_data in project['images']:
+            load_image_for_video(img_data['path'], img_data['filters'], settings['resolution'],
+                                 settings['fit_method'], hex_to_rgb(settings['bg_color']))
+    return _best_of(run, repeat), len(project['images']), 'slides'
+
+def _render_once(project, mode, scratch, encoder_profile=None):
+    """Cold render into scratch: frame cache and segment store start empty."""
+    from video_processor import render_video
+    project = dict(project, settings=dict(
+        project['settings'],
+        render_mode=mode,
+        encoder_profile=encoder_profile,
+        cache_dir=os.path.join(scratch, "frames"),
+        segment_dir=os.path.join(scratch, "segments"),
+    ))
+    start = time.perf_counter()
+    render_video(project, os.path.join(scratch, f"out_{mode}.mp4"))
+    return time.perf_counter() - start, project
+
+def _total_frames(project):
+    from transitions import plan_timeline
+    return plan_timeline(project['images'], project['settings']['fps'])[1]
+
+def stage_render(project, repeat, mode):
+    times = []
+    for _ in range(repeat):
+        scratch = tempfile.mkdtemp(prefix="bench_render_")
+        try:
+            times.append(_render_once(project, mode, scratch)[0])
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return min(times), _total_frames(project), 'frames'
+
+def stage_incremental(project, repeat):
+    from video_processor import render_video
+    times = []
+    for _ in range(repeat):
+        scratch = tempfile.mkdtemp(prefix="bench_render_")
+        try:
+            _, warm = _render_once(project, 'segments', scratch)
+            edited = dict(warm, images=list(warm['images']))
+            first = edited['images'][0]
+            edited['images'][0] = dict(first, filters=dict(first['filters'], brightness=first['filters'].get('brightness', 1.0) + 0.1))
+            start = time.perf_counter()
+            render_video(edited, os.path.join(scratch, "out_incremental.mp4"))
+            times.append(time.perf_counter() - start)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return min(times), _total_frames(project), 'frames'
+
+TRANSITION_MIX = (
+    {'transition': {'type': 'crossfade', 'duration': 0.5}},
+    {'transition': {'type': 'slide', 'direction': 'left', 'duration': 0.5}},
+    {'motion': {'type': 'kenburns', 'zoom_start': 1.0, 'zoom_end': 1.2, 'x_start': -0.5, 'x_end': 0.5}},
+    {},
+)
+
+def stage_transitions(project, repeat):
+    images = [dict(img_data, **TRANSITION_MIX[i % len(TRANSITION_MIX)]) for i, img_data in enumerate(project['images'])]
+    return stage_render(dict(project, images=images), repeat, 'segments')
+
+def stage_profile(project, repeat, profile):
+    """Segments encode with one encoder profile; frames are prepared (cached) beforehand."""
+    from segment_encoder import resolve_encoder
+    from video_processor import render_video
+    project = dict(project, audio={}) # bitrate of the video stream alone
+    scratch = tempfile.mkdtemp(prefix="bench_render_")
+    try:
+        _, warm = _render_once(project, 'segments', scratch, 'draft')
+        warm['settings']['encoder_profile'] = profile
+        output = os.path.join(scratch, f"out_{profile}.mp4")
+        times = []
+        for _ in range(repeat):
+            shutil.rmtree(warm['settings']['segment_dir'], ignore_errors=True)
+            start = time.perf_counter()
+            render_video(warm, output)
+            times.append(time.perf_counter() - start)
+        size = os.path.getsize(output)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    wall = min(times)
+    frames = _total_frames(project)
+    seconds = frames / project['settings']['fps']
+    threads = resolve_encoder(warm['settings'])['threads']
+    return wall, frames, 'frames', {
+        'bitrate_kbps': round(size * 8 / seconds / 1000),
+        'threads': threads,
+        'fps_per_thread': round(frames / wall / threads, 1),
+    }
+
+def _stage_main(name, project, repeat, results):
+    if name.startswith('render_'):
+        outcome = stage_render(project, repeat, name[len('render_'):])
+    elif name.startswith('profile_'):
+        outcome = stage_profile(project, repeat, name[len('profile_'):])
+    else:
+        outcome = globals()[f"stage_{name}"](project, repeat)
+    wall, items, unit = outcome[:3]
+    stage = {
+        'wall_s': round(wall, 4),
+        'items': items,
+        'unit': unit,
+        'throughput': round(items / wall, 2) if wall > 0 else None,
+        'peak_rss_mb': round(_peak_rss_mb(resource.RUSAGE_SELF), 1),
+        'peak_child_rss_mb': round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+    if len(outcome) > 3:
+        stage.update(outcome[3])
+    results.put(stage)
+
+def run_stage(name, project, repeat):
+    """Runs one stage in a fresh process so its peak RSS is not inflated by earlier stages."""
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=_stage_main, args=(name, project, repeat, results))
+    proc.start()
+    proc.join()
+    if proc.exitcode != 0:
+        raise RuntimeError(f"Stage {name} failed (exit code {proc.exitcode})")
+    return results.get()
+
+def compare(results, baseline, threshold):
+    """Prints stage-by-stage changes against a baseline; returns the regressed stages."""
+    regressions = []
+    print(f"\n{'stage':<20}{'base s':>10}{'now s':>10}{'change':>9}{'base MB':>10}{'now MB':>10}")
+    for name, now in results['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base:
+            print(f"{name:<20}{'-':>10}{now['wall_s']:>10.3f}{'new':>9}")
+            continue
+        time_change = now['wall_s'] / base['wall_s'] - 1 if base['wall_s'] else 0.0
+        rss_change = now['peak_rss_mb'] / base['peak_rss_mb'] - 1 if base['peak_rss_mb'] else 0.0
+        flag = ''
+        if time_change > threshold or rss_change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<20}{base['wall_s']:>10.3f}{now['wall_s']:>10.3f}{time_change:>+9.0%}"
+              f"{base['peak_rss_mb']:>10.0f}{now['peak_rss_mb']:>10.0f}{flag}")
+    if baseline.get('config') != results['config']:
+        print("note: baseline was recorded with a different configuration")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--slides', type=int, default=12)
+    parser.add_argument('--megapixels', type=float, default=12.0)
+    parser.add_argument('--duration', type=float, default=2.0, help="seconds per slide")
+    parser.add_argument('--resolution', default='1080x1920')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--text-every', type=int, default=2, help="caption every Nth slide (0: none)")
+    parser.add_argument('--no-audio', action='store_true')
+    parser.add_argument('--modes', default='segments,stream', help=f"render modes, from {','.join(RENDER_MODES)}")
+    parser.add_argument('--profiles', default='', help="encoder profiles to measure, e.g. draft,social,archive")
+    parser.add_argument('--skip', default='', help="comma-separated stages to skip")
+    parser.add_argument('--encode-jobs', type=int, default=None, help="concurrent segment encoders (default: one per two cores)")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', help="write results JSON here")
+    parser.add_argument('--baseline', help="compare against this results JSON")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed slowdown/growth vs baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    resolution = tuple(int(v) for v in args.resolution.lower().split('x'))
+    modes = [m for m in args.modes.split(',') if m]
+    for mode in modes:
+        if mode not in RENDER_MODES:
+            parser.error(f"unknown render mode: {mode}")
+    profiles = [p for p in args.profiles.split(',') if p]
+    for profile in profiles:
+        if profile not in ENCODER_PROFILES:
+            parser.error(f"unknown encoder profile: {profile}")
+    skip = set(s for s in args.skip.split(',') if s)
+    stages = IMAGE_STAGES + tuple(f"render_{m}" for m in modes) + ('incremental', 'transitions') + tuple(f"profile_{p}" for p in profiles)
+    stages = [s for s in stages if s not in skip]
+
+    config = {
+        'slides': args.slides,
+        'megapixels': args.megapixels,
+        'duration': args.duration,
+        'resolution': list(resolution),
+        'fps': args.fps,
+        'text_every': args.text_every,
+        'audio': not args.no_audio,
+        'encode_jobs': args.encode_jobs,
+        'repeat': args.repeat,
+    }
+    results = {
+        'config': config,
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': {},
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="bench_project_")
+    try:
+        # Sources are generated in a throwaway process to keep this one (and every stage forked from it) small
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            project = pool.apply(make_project, (work_dir, args.slides, args.megapixels, args.duration,
+                                                resolution, args.fps, args.text_every, not args.no_audio))
+        if args.encode_jobs:
+            project['settings']['encode_jobs'] = args.encode_jobs
+        print(f"{args.slides} slides of {args.megapixels:g} MP -> {resolution[0]}x{resolution[1]} "
+              f"@ {args.fps} fps, best of {args.repeat}")
+        print(f"{'stage':<20}{'wall s':>10}{'throughput':>16}{'peak MB':>10}{'child MB':>10}")
+        for name in stages:
+            stage = run_stage(name, project, args.repeat)
+            results['stages'][name] = stage
+            extra = ''
+            if 'bitrate_kbps' in stage:
+                extra = f"  {stage['bitrate_kbps']} kbps, {stage['fps_per_thread']} fps/thread"
+            print(f"{name:<20}{stage['wall_s']:>10.3f}{stage['throughput']:>9.1f} {stage['unit'] + '/s':<6}"
+                  f"{stage['peak_rss_mb']:>10.0f}{stage['peak_child_rss_mb']:>10.0f}{extra}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"FAIL: {', '.join(regressions)} regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import glob
+import hashlib
+import os
+import threading
+import numpy as np
+from PIL import Image
+
+DHASH_SIZE = 8 # 8x8 horizontal + 8x8 vertical gradient bits -> 128-bit hash
+NEAR_DUPLICATE_DISTANCE = 12 # max differing bits for "looks the same" (of 128)
+
+class BlobStore:
+    """
+    Content-addressed store for uploads: each distinct file is written once
+    as <digest><ext>, whatever it was called and however often it was
+    uploaded. Derivatives keyed by the same digest (ingest thumbnails and
+    proxies, frame cache entries) are then shared as well.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def find(self, digest):
+        """Stored path of a digest, or None. Uploads still being written are not found."""
+        matches = [p for p in glob.glob(os.path.join(self.root, glob.escape(digest) + ".*"))
+                   if not p.endswith(".tmp")]
+        return matches[0] if matches else None
+
+    def put(self, data, name='', reserve=None):
+        """
+        Stores bytes (anything with the buffer protocol) unless identical
+        content is already present. Returns (digest, path, is_new).
+        reserve(nbytes) is called before a new file is written and may raise
+        to refuse it (see workspace.Workspace.ensure_space).
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        existing = self.find(digest)
+        if existing:
+            return digest, existing, False
+        if reserve:
+            reserve(memoryview(data).nbytes)
+
+        ext = os.path.splitext(name)[1].lower() or ".bin"
+        path = os.path.join(self.root, digest + ext)
+        # Hidden and unique per writer: every session shares this process
+        tmp_path = os.path.join(self.root, f".{digest}{ext}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return digest, path, True
+
+def dhash(img, size=DHASH_SIZE):
+    """
+    Difference hash of a PIL image as a hex string: which of each pair of
+    neighbouring pixels is brighter, horizontally and vertically, on a small
+    grayscale thumbnail (2 * size * size bits). Re-encodes, resizes and small
+    edits of a photo flip only a few bits. None for (nearly) flat images,
+    which have no structure to compare.
+    """
+    small = np.asarray(img.convert('L').resize((size + 1, size + 1), Image.BILINEAR), dtype=np.int16)
+    if small.std() < 2:
+        return None
+    bits = np.concatenate([(small[:-1, 1:] > small[:-1, :-1]).ravel(), (small[1:, :-1] > small[:-1, :-1]).ravel()])
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):0{bits.size // 4}x}"
+
+def hash_distance(a, b):
+    """Number of differing bits between two dhash strings."""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+def find_near_duplicates(hashes, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """
+    hashes: list of dhash strings (None for unknown), e.g. one per slide.
+    Returns {index: (earlier_index, distance)} for every entry that looks like
+    an earlier one; the closest earlier match wins.
+    """
+    matches = {}
+    for i, h in enumerate(hashes):
+        if h is None:
+            continue
+        best = None
+        for j in range(i):
+            if hashes[j] is None:
+                continue
+            distance = hash_distance(h, hashes[j])
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (j, distance)
+        if best:
+            matches[i] = best
+    return matches
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "reel_editor_cache", "frames")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3 # 2 GB of processed frames
+
+# Filter values that leave the image untouched; they are dropped from cache keys
+# so that {} and {'brightness': 1.0} hit the same entry.
+FILTER_DEFAULTS = {
+    'brightness': 1.0,
+    'contrast': 1.0,
+    'saturation': 1.0,
+    'sharpness': 1.0,
+    'gamma': 1.0,
+    'blur': 0,
+    'rotate': 0,
+}
+
+# Bumped whenever the slide pipeline changes its output, so stale frames are never served
+PIPELINE_VERSION = 3
+
+# Parameters that only matter when their effect is switched on
+FILTER_PARAMS = {
+    'posterize': ('posterize_bits', 4),
+    'solarize': ('solarize_threshold', 128),
+}
+
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
+def file_digest(path):
+    """SHA-256 of a file's contents, memoized on (path, size, mtime)."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_memo.get(memo_key)
+    if digest:
+        return digest
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+    return digest
+
+def normalize_filters(filters):
+    """Canonical form of a filters dict: defaults and disabled effects removed, floats rounded."""
+    normalized = {}
+    for name, value in (filters or {}).items():
+        if name in ('posterize_bits', 'solarize_threshold'):
+            continue
+        if isinstance(value, bool):
+            if value:
+                normalized[name] = True
+                if name in FILTER_PARAMS:
+                    param, default = FILTER_PARAMS[name]
+                    normalized[param] = filters.get(param, default)
+            continue
+        if value is None:
+            continue
+        if isinstance(value, float):
+            value = round(value, 4)
+        if name in FILTER_DEFAULTS and value == FILTER_DEFAULTS[name]:
+            continue
+        normalized[name] = value
+    return normalized
+
+def frame_key(image_data, global_settings):
+    """Content address of a slide's processed frame (before text overlay)."""
+    payload = {
+        'pipeline': PIPELINE_VERSION,
+        'source': file_digest(image_data['path']),
+        'filters': normalize_filters(image_data.get('filters', {})),
+        'resolution': list(global_settings.get('resolution', (1080, 1920))),
+        'fit_method': global_settings.get('fit_method', 'contain'),
+        'bg_color': global_settings.get('bg_color', '#000000').lower(),
+    }
+    blob = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+class FrameCache:
+    """
+    Disk-backed LRU of processed slide frames stored as raw .npy arrays.
+    Entries are memory-mapped on read; recency is tracked with the file mtime,
+    so several processes can share one cache directory.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key):
+        """Returns the cached frame (read-only memmap) or None."""
+        path = self.path_for(key)
+        try:
+            frame = np.load(path, mmap_mode='r')
+            os.utime(path) # mark as recently used
+        except (FileNotFoundError, ValueError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return frame
+
+    def put(self, key, frame):
+        """Stores a frame atomically and evicts old entries if over budget."""
+        path = self.path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(frame))
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def get_or_create(self, key, factory):
+        """Returns the cached frame for `key`, calling factory() and storing its result on a miss."""
+        frame = self.get(key)
+        if frame is not None:
+            return frame
+        frame = np.asarray(factory())
+        self.put(key, frame)
+        return frame
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_frame_cache(cache_dir=None, max_bytes=None):
+    """Shared FrameCache per directory, so stats and budgets survive Streamlit reruns."""
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            cache = FrameCache(cache_dir, max_bytes or DEFAULT_MAX_BYTES)
+            _caches[cache_dir] = cache
+        elif max_bytes:
+            cache.max_bytes = max_bytes
+    return cache
@@ -0,0 +1,156 @@
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from PIL import Image, ImageOps
+from profiling import span
+
+EXIF_ORIENTATION = 0x0112
+DEFAULT_MAX_DECODED_BYTES = 128 * 1024 ** 2 # decoded sources kept per process (pool workers each have one)
+
+def exif_orientation(img):
+    """EXIF orientation tag (1-8), 1 when absent."""
+    try:
+        return int(img.getexif().get(EXIF_ORIENTATION, 1))
+    except Exception:
+        return 1
+
+def oriented_size(size, orientation):
+    """Image size once EXIF orientation is applied (5-8 swap width and height)."""
+    if orientation in (5, 6, 7, 8):
+        return size[1], size[0]
+    return size
+
+def file_identity(path):
+    """Cheap stand-in for a file's content: (absolute path, size, mtime)."""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+@lru_cache(maxsize=1024)
+def _image_info(identity):
+    with Image.open(identity[0]) as img:
+        orientation = exif_orientation(img)
+        return {'size': oriented_size(img.size, orientation), 'orientation': orientation, 'format': img.format}
+
+def image_info(path):
+    """
+    Header-only facts about an image: {'size' (EXIF-oriented), 'orientation',
+    'format'}. Nothing is decoded; results are memoized per file identity.
+    """
+    return _image_info(file_identity(path))
+
+class DecodeCache:
+    """
+    Byte-bounded LRU of decoded, EXIF-oriented RGB sources, keyed by file
+    identity and decoded size. Any cached decode at least as large as a
+    request serves it, so a full-size render decode also covers previews.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_DECODED_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # (identity, kind, size) -> image
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, identity, min_size):
+        """Smallest cached decode of identity covering min_size (w, h), or None."""
+        with self._lock:
+            best = None
+            for key, img in self._entries.items():
+                if key[0] == identity and key[1] == 'decode' and img.size[0] >= min_size[0] and img.size[1] >= min_size[1]:
+                    if best is None or img.size[0] < best[1].size[0]:
+                        best = (key, img)
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best[0])
+            self.hits += 1
+            return best[1]
+
+    def get(self, key):
+        with self._lock:
+            img = self._entries.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return img
+
+    def put(self, key, img):
+        size = img.size[0] * img.size[1] * len(img.getbands())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = img
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old.size[0] * old.size[1] * len(old.getbands())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+_cache = DecodeCache()
+
+def get_decode_cache():
+    """The process-wide decode cache (each pool worker has its own)."""
+    return _cache
+
+def _decode(path, identity, min_size):
+    """Decodes at the smallest JPEG DCT scale (1/1 .. 1/8) still covering min_size, then applies EXIF orientation."""
+    info = _image_info(identity)
+    with span('decode', path=os.path.basename(path)) as decode_span:
+        with Image.open(path) as img:
+            if min_size[0] < info['size'][0] or min_size[1] < info['size'][1]:
+                # No-op for formats other than JPEG
+                img.draft('RGB', oriented_size(min_size, info['orientation']))
+            if info['orientation'] != 1:
+                img = ImageOps.exif_transpose(img)
+            img = img.convert('RGB')
+        decode_span.set(size=list(img.size))
+    return img
+
+def load_image(path, min_size=None, max_edge=None):
+    """
+    Returns an EXIF-oriented RGB image of path, shared through the decode
+    cache: treat it as read-only (copy before pasting or thumbnail()).
+
+    - min_size: (w, h) the caller needs; JPEGs are decoded with draft()
+      straight at the smallest DCT scale that still covers it (the result
+      may be larger). Default: full size.
+    - max_edge: shrink to fit a max_edge square (LANCZOS), for proxies and
+      thumbnails. The shrunk image is cached too.
+    """
+    identity = file_identity(path)
+    full_size = _image_info(identity)['size']
+
+    if max_edge is not None:
+        scale = max_edge / max(full_size)
+        if scale >= 1.0:
+            return load_image(path)
+        key = (identity, 'edge', max_edge)
+        img = _cache.get(key)
+        if img is None:
+            img = load_image(path, (int(full_size[0] * scale), int(full_size[1] * scale))).copy()
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=3.0)
+            _cache.put(key, img)
+        return img
+
+    min_size = (min(min_size[0], full_size[0]), min(min_size[1], full_size[1])) if min_size else full_size
+    img = _cache.find(identity, min_size)
+    if img is None:
+        img = _decode(path, identity, min_size)
+        _cache.put((identity, 'decode', img.size), img)
+    return img
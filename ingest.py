@@ -0,0 +1,71 @@
+import json
+import os
+from PIL import Image
+from frame_cache import file_digest
+from image_loader import load_image, image_info
+from blob_store import dhash
+
+THUMB_EDGE = 200 # timeline thumbnails (long edge, px)
+PROXY_EDGE = 1024 # preview proxies; also the decode size used by preview.py
+
+def ingest_image(path, out_dir):
+    """
+    Processes an upload once: decodes it at proxy size (JPEG draft mode),
+    applies EXIF orientation and writes a thumbnail and a preview proxy.
+    Returns the 'media' dict stored on the slide:
+        width, height (oriented), format, orientation, bytes, digest,
+        thumb_path, thumb_size, proxy_path, proxy_size, dhash
+    Derivatives are named by content digest, so identical files (under any
+    name) are only processed the first time.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    digest = file_digest(path)
+    thumb_path = os.path.join(out_dir, f"{digest[:16]}_thumb.jpg")
+    proxy_path = os.path.join(out_dir, f"{digest[:16]}_proxy.jpg")
+    media_path = os.path.join(out_dir, f"{digest[:16]}_media.json")
+
+    try:
+        with open(media_path) as f:
+            media = json.load(f)
+        if media.get('digest') == digest and os.path.exists(thumb_path) and os.path.exists(proxy_path):
+            return media
+    except (FileNotFoundError, ValueError):
+        pass
+
+    info = image_info(path)
+    width, height = info['size']
+    proxy = load_image(path, max_edge=PROXY_EDGE)
+    proxy.save(proxy_path, quality=88)
+
+    thumb = proxy.copy()
+    thumb.thumbnail((THUMB_EDGE, THUMB_EDGE), Image.LANCZOS)
+    thumb.save(thumb_path, quality=85)
+
+    media = {
+        'width': width,
+        'height': height,
+        'format': info['format'],
+        'orientation': info['orientation'],
+        'bytes': os.path.getsize(path),
+        'digest': digest,
+        'thumb_path': thumb_path,
+        'thumb_size': thumb.size,
+        'proxy_path': proxy_path,
+        'proxy_size': proxy.size,
+        'dhash': dhash(proxy),
+    }
+    tmp_path = f"{media_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(media, f)
+    os.replace(tmp_path, media_path)
+    return media
+
+def ensure_media(image_data, out_dir):
+    """Ingests slides added before ingest existed (or whose derivatives were removed)."""
+    media = image_data.get('media')
+    # dhash is None for flat images; only media from before dhash existed lacks the key
+    if (media and 'dhash' in media and os.path.exists(media.get('thumb_path', ''))
+            and os.path.exists(media.get('proxy_path', ''))):
+        return media
+    image_data['media'] = ingest_image(image_data['path'], out_dir)
+    return image_data['media']
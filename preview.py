@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from utils import plan_slide_pipeline, process_image_for_video, hex_to_rgb
+from image_loader import load_image, image_info, file_identity
+from frame_cache import normalize_filters
+from ingest import PROXY_EDGE
+from text_overlay import burn_text
+
+PREVIEW_LONG_EDGE = 480 # 1080x1920 -> 270x480
+MAX_PREVIEW_FRAMES = 256
+
+class LRUDict:
+    """Small thread-safe LRU mapping (Streamlit serves sessions from several threads)."""
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+_preview_frames = LRUDict(MAX_PREVIEW_FRAMES)
+
+def proxy_resolution(resolution, long_edge=PREVIEW_LONG_EDGE):
+    """Scales the output resolution so its long edge is `long_edge` (even sizes)."""
+    w, h = resolution
+    scale = long_edge / max(w, h)
+    return (max(2, int(round(w * scale / 2)) * 2), max(2, int(round(h * scale / 2)) * 2))
+
+def load_proxy_source(path, media=None):
+    """
+    Returns (proxy_image, original_size): the EXIF-oriented source at about
+    PROXY_EDGE pixels, from image_loader's shared decode cache. Uses the
+    proxy written at ingest time when the slide has one, otherwise decodes
+    the original in draft mode.
+    """
+    if media and os.path.exists(media.get('proxy_path', '')):
+        return load_image(media['proxy_path']), (media['width'], media['height'])
+    return load_image(path, max_edge=PROXY_EDGE), image_info(path)['size']
+
+def _preview_key(image_data, global_settings, long_edge):
+    return json.dumps({
+        'source': file_identity(image_data['path']),
+        'filters': normalize_filters(image_data.get('filters', {})),
+        'text': image_data.get('text_overlay') or {},
+        'resolution': list(global_settings.get('resolution', (1080, 1920))),
+        'fit_method': global_settings.get('fit_method', 'contain'),
+        'bg_color': global_settings.get('bg_color', '#000000'),
+        'long_edge': long_edge,
+    }, sort_keys=True)
+
+def render_preview(image_data, global_settings, long_edge=PREVIEW_LONG_EDGE):
+    """
+    Renders one slide at proxy resolution (long edge `long_edge`) from the
+    cached proxy decode. Same filters, fit and caption as the full render,
+    with blur radius and font size scaled to the proxy.
+    """
+    key = _preview_key(image_data, global_settings, long_edge)
+    cached = _preview_frames.get(key)
+    if cached is not None:
+        return cached
+
+    resolution = global_settings.get('resolution', (1080, 1920))
+    target = proxy_resolution(resolution, long_edge)
+    fit_method = global_settings.get('fit_method', 'contain')
+    bg_color = hex_to_rgb(global_settings.get('bg_color', '#000000'))
+    filters = image_data.get('filters', {})
+
+    src, original_size = load_proxy_source(image_data['path'], image_data.get('media'))
+    # Plan against the original size so blur is rescaled from full-resolution pixels
+    plan = plan_slide_pipeline(original_size, filters, target, fit_method)
+    if not plan['downscale_first'] and filters.get('blur', 0) > 0:
+        filters = dict(filters, blur=filters['blur'] * src.size[0] / original_size[0])
+    img = process_image_for_video(src, filters, target, fit_method, bg_color,
+                                  plan if plan['downscale_first'] else None)
+
+    text_overlay = image_data.get('text_overlay', {})
+    if text_overlay and text_overlay.get('text'):
+        scale = target[0] / resolution[0]
+        scaled = dict(text_overlay, fontsize=max(1, int(round(text_overlay.get('fontsize', 50) * scale))))
+        img = burn_text(img, scaled)
+
+    _preview_frames.put(key, img)
+    return img
+
+def render_preview_strip(images, global_settings, start=0, count=5, long_edge=PREVIEW_LONG_EDGE):
+    """Previews a stretch of the timeline: slides [start, start + count)."""
+    return [render_preview(img_data, global_settings, long_edge) for img_data in images[start:start + count]]
@@ -0,0 +1,152 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Profiler collecting spans for the current render; None when profiling is off.
+# A context variable, so concurrent renders (render_jobs workers) keep separate traces.
+_active = contextvars.ContextVar('reel_profiler', default=None)
+
+class _NullSpan:
+    """Returned by span() when profiling is off: entering and leaving cost one attribute lookup."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, profiler, name, cat, args):
+        self.profiler = profiler
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.cat, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+    def set(self, **args):
+        """Attaches extra args discovered inside the span (e.g. cache hit)."""
+        self.args.update(args)
+
+class Profiler:
+    """
+    Collects timing spans as Chrome trace events ("X" complete events), viewable
+    in chrome://tracing or https://ui.perfetto.dev. Timestamps come from the
+    monotonic perf_counter, which is system-wide, so spans recorded in pool
+    workers line up with the parent's once merged.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, name, cat, start_ns, end_ns, args=None):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': start_ns / 1000,
+            'dur': (end_ns - start_ns) / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_native_id(),
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+
+    def merge(self, events):
+        with self._lock:
+            self.events.extend(events)
+
+    @contextmanager
+    def activate(self):
+        """Makes this the profiler that span() records into, for the current context."""
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+    def trace(self):
+        return {'traceEvents': sorted(self.events, key=lambda e: e['ts']), 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
+        return path
+
+def span(name, cat='render', **args):
+    """
+    Times a block as a trace span when a profiler is active:
+
+        with span('decode', path=path):
+            ...
+    """
+    profiler = _active.get()
+    if profiler is None:
+        return _NULL_SPAN
+    return _Span(profiler, name, cat, args)
+
+def collect_spans(fn, *args, **kwargs):
+    """
+    Runs fn under a fresh profiler and returns (result, events). Used in
+    pool workers, whose spans are shipped back and merged with merge_spans.
+    """
+    profiler = Profiler()
+    with profiler.activate():
+        result = fn(*args, **kwargs)
+    return result, profiler.events
+
+def merge_spans(events):
+    """Adds events recorded elsewhere (another process) to the active profiler, if any."""
+    profiler = _active.get()
+    if profiler is not None and events:
+        profiler.merge(events)
+
+def trace_path_for(output_path):
+    """Where render_video writes the trace for a render to output_path."""
+    return os.path.splitext(output_path)[0] + ".trace.json"
+
+def summarize(events):
+    """
+    Aggregates spans by name: [{'name', 'cat', 'count', 'total_ms', 'mean_ms', 'max_ms'}],
+    slowest total first. Totals are inclusive: a span's time also counts in its parents.
+    """
+    stats = {}
+    for event in events:
+        if event.get('ph') != 'X':
+            continue
+        entry = stats.setdefault(event['name'], {'name': event['name'], 'cat': event.get('cat', ''),
+                                                 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        dur_ms = event['dur'] / 1000
+        entry['count'] += 1
+        entry['total_ms'] += dur_ms
+        entry['max_ms'] = max(entry['max_ms'], dur_ms)
+
+    rows = sorted(stats.values(), key=lambda e: e['total_ms'], reverse=True)
+    for row in rows:
+        row['mean_ms'] = row['total_ms'] / row['count']
+        for key in ('total_ms', 'mean_ms', 'max_ms'):
+            row[key] = round(row[key], 2)
+    return rows
+
+def load_trace(path):
+    with open(path) as f:
+        return json.load(f).get('traceEvents', [])
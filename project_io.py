@@ -0,0 +1,164 @@
+import io
+import json
+import os
+import zipfile
+
+try:
+    import yaml
+except ImportError: # YAML project files are optional
+    yaml = None
+
+PROJECT_FORMAT_VERSION = 1
+
+DEFAULT_SETTINGS = {
+    'resolution': (1080, 1920),
+    'fps': 30,
+    'bg_color': '#000000',
+    'fit_method': 'contain',
+    'render_mode': 'segments',
+}
+
+# Keys that only make sense inside one running app/render; never written to project files
+RUNTIME_SLIDE_KEYS = ('media',)
+RUNTIME_SETTING_KEYS = ('segment_dir', 'cache_dir', 'workers', 'max_in_flight', 'encode_jobs', 'profile')
+
+class ProjectFormatError(ValueError):
+    """Raised when a project file is malformed."""
+
+def _is_yaml(path):
+    return os.path.splitext(path)[1].lower() in ('.yaml', '.yml')
+
+def snapshot(project):
+    """
+    Deep copy of a project that survives a JSON round trip, with settings
+    normalized (resolution back to a tuple, defaults filled in).
+    """
+    project = json.loads(json.dumps(project))
+    project.setdefault('images', [])
+    project['audio'] = project.get('audio') or {}
+    project['settings'] = dict(DEFAULT_SETTINGS, **(project.get('settings') or {}))
+    project['settings']['resolution'] = tuple(project['settings']['resolution'])
+    return project
+
+def to_document(project, base_dir=None):
+    """
+    The project as written to disk: runtime-only keys removed and, with
+    base_dir, media paths made relative to it so the folder can be moved.
+    """
+    project = snapshot(project)
+
+    def portable(path):
+        if base_dir and path and os.path.isabs(path):
+            return os.path.relpath(path, base_dir)
+        return path
+
+    images = []
+    for img_data in project['images']:
+        img_data = {k: v for k, v in img_data.items() if k not in RUNTIME_SLIDE_KEYS}
+        img_data['path'] = portable(img_data['path'])
+        images.append(img_data)
+
+    audio = dict(project['audio'])
+    if audio.get('path'):
+        audio['path'] = portable(audio['path'])
+
+    settings = {k: v for k, v in project['settings'].items() if k not in RUNTIME_SETTING_KEYS}
+    settings['resolution'] = list(settings['resolution'])
+
+    document = {'version': PROJECT_FORMAT_VERSION, 'images': images, 'audio': audio, 'settings': settings}
+    for key in ('name', 'output'):
+        if project.get(key):
+            document[key] = project[key]
+    return document
+
+def from_document(document, base_dir=None):
+    """Validates a parsed project file and resolves relative media paths against base_dir."""
+    if not isinstance(document, dict):
+        raise ProjectFormatError("Project must be a mapping with an 'images' list")
+    version = document.get('version', PROJECT_FORMAT_VERSION)
+    if version > PROJECT_FORMAT_VERSION:
+        raise ProjectFormatError(f"Project format version {version} is newer than supported ({PROJECT_FORMAT_VERSION})")
+    images = document.get('images')
+    if not isinstance(images, list) or not images:
+        raise ProjectFormatError("Project has no images")
+
+    def resolve(path):
+        if base_dir and not os.path.isabs(path):
+            return os.path.normpath(os.path.join(base_dir, path))
+        return path
+
+    project = snapshot({k: v for k, v in document.items() if k != 'version'})
+    for idx, img_data in enumerate(project['images']):
+        if not isinstance(img_data, dict) or not img_data.get('path'):
+            raise ProjectFormatError(f"Slide {idx + 1} has no 'path'")
+        img_data['path'] = resolve(img_data['path'])
+        img_data.setdefault('filters', {})
+        img_data.setdefault('duration', 3.0)
+        img_data.setdefault('text_overlay', {})
+    if project['audio'].get('path'):
+        project['audio']['path'] = resolve(project['audio']['path'])
+    return project
+
+def load_project(path):
+    """Reads a .json or .yaml/.yml project file; media paths are resolved relative to it."""
+    with open(path) as f:
+        if _is_yaml(path):
+            if yaml is None:
+                raise ImportError("Reading YAML projects requires PyYAML (pip install pyyaml)")
+            document = yaml.safe_load(f)
+        else:
+            try:
+                document = json.load(f)
+            except ValueError as e:
+                raise ProjectFormatError(f"{os.path.basename(path)}: {e}") from e
+    return from_document(document, os.path.dirname(os.path.abspath(path)))
+
+def dumps_project(project, fmt='json', base_dir=None):
+    """Serializes a project as JSON or YAML text."""
+    document = to_document(project, base_dir)
+    if fmt == 'yaml':
+        if yaml is None:
+            raise ImportError("Writing YAML projects requires PyYAML (pip install pyyaml)")
+        return yaml.safe_dump(document, sort_keys=False)
+    return json.dumps(document, indent=2)
+
+def bundle_project(project, name="reel_project"):
+    """
+    A zip (as bytes) of a <name>/ folder holding <name>.json plus every slide
+    and the audio under media/, with relative paths, so the project renders
+    on another machine.
+    """
+    project = snapshot(project)
+    arcnames = {}
+
+    def pack(path):
+        if path not in arcnames:
+            base, ext = os.path.splitext(os.path.basename(path))
+            arcname, n = f"media/{base}{ext}", 1
+            while arcname in arcnames.values():
+                n += 1
+                arcname = f"media/{base}_{n}{ext}"
+            arcnames[path] = arcname
+        return arcnames[path]
+
+    for img_data in project['images']:
+        img_data['path'] = pack(img_data['path'])
+    if project['audio'].get('path'):
+        project['audio']['path'] = pack(project['audio']['path'])
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr(f"{name}/{name}.json", dumps_project(project))
+        for path, arcname in arcnames.items():
+            zf.write(path, f"{name}/{arcname}") # stored: media is already compressed
+    return buffer.getvalue()
+
+def save_project(project, path, relative=True):
+    """Writes a project file (format from the extension); media paths are stored relative to it by default."""
+    base_dir = os.path.dirname(os.path.abspath(path)) if relative else None
+    text = dumps_project(project, 'yaml' if _is_yaml(path) else 'json', base_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return path
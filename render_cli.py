@@ -0,0 +1,187 @@
+"""
+Headless batch renderer for project files (see project_io.py).
+
+    python render_cli.py projects/ --output-dir renders/
+    python render_cli.py reels/*.yaml --output-dir renders/ --encoder-profile social --workers 8
+
+All projects render in one process that shares the frame and audio caches
+and a single slide-preparation pool. Progress is recorded in
+<output-dir>/render_state.json: running the same command again skips
+projects that finished with unchanged files and settings, and an
+interrupted project only re-encodes the slides whose segments are missing.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from project_io import load_project, to_document, ProjectFormatError
+from frame_cache import file_digest
+from segment_encoder import ENCODER_PROFILES
+from segment_store import SegmentStore
+from slide_pool import default_workers
+from video_processor import render_video
+
+PROJECT_EXTENSIONS = ('.json', '.yaml', '.yml')
+STATE_NAME = "render_state.json"
+
+def find_projects(paths):
+    """Project files named on the command line; directories contribute their project files (sorted)."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(PROJECT_EXTENSIONS) and name != STATE_NAME:
+                    found.append(os.path.join(path, name))
+        else:
+            found.append(path)
+    return [os.path.abspath(p) for p in found]
+
+def project_fingerprint(project):
+    """Changes whenever the rendered video would: project settings plus the content of every media file."""
+    document = to_document(project)
+    media = [img_data['path'] for img_data in project['images']]
+    if project['audio'].get('path'):
+        media.append(project['audio']['path'])
+    payload = {'project': document, 'media': [file_digest(p) for p in media]}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def output_path_for(project_path, project, output_dir):
+    """Where a project renders to; its 'output' name may not point outside output_dir."""
+    name = project.get('output') or os.path.splitext(os.path.basename(project_path))[0] + ".mp4"
+    output_dir = os.path.abspath(output_dir)
+    output_path = os.path.abspath(os.path.join(output_dir, name))
+    if os.path.commonpath([output_dir, output_path]) != output_dir or output_path == output_dir:
+        raise ProjectFormatError(f"'output' {name!r} is outside the output directory")
+    return output_path
+
+class RenderState:
+    """Per-project results in <output-dir>/render_state.json, saved after every project."""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, STATE_NAME)
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def is_done(self, project_path, fingerprint, output_path):
+        entry = self.entries.get(project_path)
+        return (entry is not None and entry['status'] == 'done' and entry['fingerprint'] == fingerprint
+                and entry['output'] == output_path and os.path.exists(output_path))
+
+    def record(self, project_path, **entry):
+        self.entries[project_path] = dict(entry, updated=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+def render_one(project, output_path, segment_dir, executor):
+    """Renders to a temporary name first, so an interrupted render never leaves a partial .mp4 behind."""
+    project = dict(project, settings=dict(project['settings'], segment_dir=segment_dir))
+    partial_path = os.path.splitext(output_path)[0] + ".part.mp4"
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    render_video(project, partial_path, executor=executor)
+    os.replace(partial_path, output_path)
+    return SegmentStore(segment_dir).load_manifest().get('last_render', {})
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('projects', nargs='+', help="project files or directories of them")
+    parser.add_argument('--output-dir', '-o', required=True)
+    parser.add_argument('--workers', type=int, default=None, help="slide preparation processes (default: one per core)")
+    parser.add_argument('--encode-jobs', type=int, default=None,
+                        help="segments encoded at once, each by its own ffmpeg (default: one per two cores)")
+    parser.add_argument('--encoder-profile', choices=list(ENCODER_PROFILES), help="override every project's profile")
+    parser.add_argument('--render-mode', choices=['segments', 'stream', 'compose'], help="override every project's mode")
+    parser.add_argument('--cache-dir', help="frame cache directory (default: shared system temp cache)")
+    parser.add_argument('--force', action='store_true', help="re-render projects that already finished")
+    parser.add_argument('--keep-segments', action='store_true', help="keep per-slide segments after a project finishes")
+    args = parser.parse_args(argv)
+
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    state = RenderState(output_dir)
+
+    # Load everything up front so a typo fails fast instead of hours into the batch
+    jobs, outputs, failed = [], {}, 0
+    for project_path in find_projects(args.projects):
+        try:
+            project = load_project(project_path)
+            output_path = output_path_for(project_path, project, output_dir)
+        except (OSError, ProjectFormatError, ImportError) as e:
+            print(f"error: {project_path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        if args.encoder_profile:
+            project['settings']['encoder_profile'] = args.encoder_profile
+        if args.render_mode:
+            project['settings']['render_mode'] = args.render_mode
+        if args.cache_dir:
+            project['settings']['cache_dir'] = args.cache_dir
+        if args.encode_jobs:
+            project['settings']['encode_jobs'] = args.encode_jobs
+        if output_path in outputs:
+            parser.error(f"{project_path} and {outputs[output_path]} both render to {output_path}")
+        outputs[output_path] = project_path
+        jobs.append((project_path, project, output_path))
+
+    workers = args.workers or default_workers()
+    print(f"{len(jobs)} projects -> {output_dir} ({workers} workers)")
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    rendered = skipped = 0
+    try:
+        for n, (project_path, project, output_path) in enumerate(jobs, 1):
+            label = f"[{n}/{len(jobs)}] {os.path.basename(project_path)}"
+            try:
+                fingerprint = project_fingerprint(project)
+            except OSError as e:
+                print(f"{label}: missing media: {e}", file=sys.stderr)
+                state.record(project_path, status='failed', fingerprint=None, output=output_path, error=str(e))
+                failed += 1
+                continue
+            if not args.force and state.is_done(project_path, fingerprint, output_path):
+                print(f"{label}: up to date")
+                skipped += 1
+                continue
+
+            # Keyed by project file, so a re-run after an edit or interruption reuses its segments
+            segment_dir = os.path.join(output_dir, ".segments", hashlib.sha1(project_path.encode()).hexdigest()[:12])
+            start = time.perf_counter()
+            try:
+                stats = render_one(project, output_path, segment_dir, executor)
+            except Exception as e:
+                print(f"{label}: failed: {e}", file=sys.stderr)
+                state.record(project_path, status='failed', fingerprint=fingerprint, output=output_path, error=str(e))
+                failed += 1
+                if isinstance(e.__cause__ or e, BrokenProcessPool):
+                    # A worker died (e.g. out of memory); start a fresh pool for the rest of the batch
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=workers)
+                continue
+
+            seconds = time.perf_counter() - start
+            state.record(project_path, status='done', fingerprint=fingerprint, output=output_path,
+                         seconds=round(seconds, 2), segments=stats)
+            if not args.keep_segments:
+                shutil.rmtree(segment_dir, ignore_errors=True)
+            rendered += 1
+            print(f"{label}: {seconds:.1f}s -> {os.path.relpath(output_path, output_dir)}")
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume.", file=sys.stderr)
+        return 130
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    print(f"Done: {rendered} rendered, {skipped} up to date, {failed} failed")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
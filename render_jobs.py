@@ -0,0 +1,296 @@
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from video_processor import render_video
+from segment_store import SegmentStore
+from profiling import trace_path_for
+from project_io import snapshot
+
+DEFAULT_JOBS_DIR = os.path.join(tempfile.gettempdir(), "reel_editor_cache", "jobs")
+PROGRESS_SAVE_INTERVAL = 0.5 # seconds between progress writes to disk
+FINISHED_JOB_TTL = 24 * 3600 # seconds finished jobs stay listed before their records are deleted
+
+ACTIVE_STATES = ('queued', 'running')
+
+class RenderCancelled(Exception):
+    """Raised inside a render when its job has been cancelled."""
+
+def _process_started(pid):
+    """Start time of a process (clock ticks since boot) from /proc, or None where unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces; fields after it are fixed
+            return int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _process_alive(pid, started=None):
+    """
+    Whether the process that recorded (pid, started) still runs (POSIX;
+    elsewhere never). A reused pid is told apart by its start time where
+    /proc has one.
+    """
+    if not pid or os.name != 'posix':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if started is not None:
+        return _process_started(pid) == started
+    return True
+
+def default_max_concurrent():
+    """Each render already uses a process pool and multi-threaded x264, so keep this small."""
+    return max(1, (os.cpu_count() or 1) // 4)
+
+class JobManager:
+    """
+    Persistent render queue with a bounded pool of worker threads.
+
+    Every job is a JSON file in jobs_dir holding the project snapshot, status
+    ('queued', 'running', 'done', 'failed', 'cancelled'), progress, result and
+    the pid (and start time) of the process running it. Jobs left queued or running by a
+    process that has exited are claimed and queued again on start-up (segment
+    manifests make the re-run incremental); jobs of live processes are left
+    alone. Snapshots are dropped once a job finishes and finished jobs are
+    deleted after FINISHED_JOB_TTL.
+    """
+
+    def __init__(self, jobs_dir=DEFAULT_JOBS_DIR, max_concurrent=None):
+        self.jobs_dir = jobs_dir
+        self.max_concurrent = max_concurrent or default_max_concurrent()
+        self._jobs = {}
+        self._queued = [] # queued job ids, in the order workers take them
+        self._cancel_flags = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+        self._recover()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"render-worker-{i}", daemon=True)
+            for i in range(self.max_concurrent)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    # --- persistence ---
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        tmp_path = self._job_path(job['id']) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._job_path(job['id']))
+
+    def _claim(self, job_id):
+        """
+        Takes over an orphaned job file. The rename is atomic, so when several
+        processes start at once only one of them gets it. Returns the job or None.
+        """
+        claim_path = f"{self._job_path(job_id)}.{os.getpid()}.claim"
+        try:
+            os.rename(self._job_path(job_id), claim_path)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(claim_path) as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        finally:
+            try:
+                os.remove(claim_path)
+            except FileNotFoundError:
+                pass
+        return job
+
+    def _recover(self):
+        pending = []
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.jobs_dir, name)) as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if job['status'] in ACTIVE_STATES:
+                # Another live server or CLI process is still running it. Our own
+                # pid can only be a leftover (e.g. pid 1 again after a container
+                # restart): nothing of ours runs while the constructor does.
+                if job.get('pid') != os.getpid() and _process_alive(job.get('pid'), job.get('pid_started')):
+                    continue
+                job = self._claim(job['id'])
+                if job is None or job['status'] not in ACTIVE_STATES:
+                    continue
+                job['project'] = snapshot(job['project'])
+                job['pid'] = os.getpid()
+                job['pid_started'] = _process_started(os.getpid())
+                job['status'] = 'queued'
+                job['progress'] = 0.0
+                pending.append(job)
+                self._save(job)
+            else:
+                job.pop('project', None)
+            self._jobs[job['id']] = job
+        for job in sorted(pending, key=lambda j: j['created']):
+            self._queued.append(job['id'])
+            self._queue.put(job['id'])
+        self._prune()
+
+    def _prune(self):
+        """Deletes finished jobs older than FINISHED_JOB_TTL (call with the lock held or before workers start)."""
+        cutoff = time.time() - FINISHED_JOB_TTL
+        for job_id, job in list(self._jobs.items()):
+            if job['status'] not in ACTIVE_STATES and (job['finished'] or job['created']) < cutoff:
+                del self._jobs[job_id]
+                try:
+                    os.remove(self._job_path(job_id))
+                except FileNotFoundError:
+                    pass
+
+    # --- public API ---
+    def submit(self, project, output_path, owner=None):
+        """Queues a render of `project` to `output_path`; returns the job id."""
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'owner': owner,
+            'pid': os.getpid(),
+            'pid_started': _process_started(os.getpid()),
+            'status': 'queued',
+            'progress': 0.0,
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+            'output_path': output_path,
+            'error': None,
+            'stats': {},
+            'project': snapshot(project),
+        }
+        with self._lock:
+            self._prune()
+            self._jobs[job['id']] = job
+            self._queued.append(job['id'])
+            self._save(job)
+        self._queue.put(job['id'])
+        return job['id']
+
+    def _info(self, job, positions):
+        info = {k: v for k, v in job.items() if k != 'project'}
+        if job['status'] == 'queued' and job['id'] in positions:
+            info['queue_position'] = positions[job['id']]
+        return info
+
+    def _positions(self):
+        return {job_id: i + 1 for i, job_id in enumerate(self._queued)}
+
+    def status(self, job_id):
+        """Job record without the project snapshot, plus its queue position; None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            positions = {job_id: self._queued.index(job_id) + 1} if job_id in self._queued else {}
+            return self._info(job, positions)
+
+    def list_jobs(self, owner=None):
+        with self._lock:
+            positions = self._positions()
+            jobs = [j for j in self._jobs.values() if owner is None or j['owner'] == owner]
+            return [self._info(j, positions) for j in sorted(jobs, key=lambda j: j['created'])]
+
+    def cancel(self, job_id):
+        """Cancels a queued job immediately, or asks a running one to stop at its next progress report."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] not in ACTIVE_STATES:
+                return False
+            if job['status'] == 'queued':
+                job['status'] = 'cancelled'
+                job['finished'] = time.time()
+                job.pop('project', None)
+                self._queued.remove(job_id)
+                self._save(job)
+            else:
+                self._cancel_flags[job_id] = True
+        return True
+
+    # --- worker side ---
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job['status'] != 'queued':
+                    continue
+                self._queued.remove(job_id)
+                job['status'] = 'running'
+                job['started'] = time.time()
+                self._save(job)
+            self._run(job)
+
+    def _run(self, job):
+        job_id = job['id']
+        last_save = [0.0]
+
+        def progress(p):
+            if self._cancel_flags.get(job_id):
+                raise RenderCancelled(f"Job {job_id} cancelled")
+            with self._lock:
+                job['progress'] = float(p)
+                now = time.time()
+                if now - last_save[0] >= PROGRESS_SAVE_INTERVAL:
+                    last_save[0] = now
+                    self._save(job)
+
+        try:
+            os.makedirs(os.path.dirname(job['output_path']) or '.', exist_ok=True)
+            render_video(job['project'], job['output_path'], progress)
+            status, error = 'done', None
+        except RenderCancelled:
+            status, error = 'cancelled', None
+        except Exception as e:
+            status, error = 'failed', f"{e}\n{traceback.format_exc()}"
+
+        stats = {}
+        settings = job['project'].get('settings', {})
+        segment_dir = settings.get('segment_dir')
+        if status == 'done' and segment_dir and settings.get('render_mode', 'segments') == 'segments':
+            stats['segments'] = SegmentStore(segment_dir).load_manifest().get('last_render', {})
+        if settings.get('profile') and os.path.exists(trace_path_for(job['output_path'])):
+            stats['trace_path'] = trace_path_for(job['output_path'])
+
+        with self._lock:
+            job['status'] = status
+            job['error'] = error
+            job['stats'] = stats
+            job['finished'] = time.time()
+            if status == 'done':
+                job['progress'] = 1.0
+            job.pop('project', None) # only needed to (re)run the job
+            self._cancel_flags.pop(job_id, None)
+            self._save(job)
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_job_manager(jobs_dir=None, max_concurrent=None):
+    """
+    Process-wide JobManager. Streamlit runs every session in the same process,
+    so all sessions share one bounded set of render workers.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(jobs_dir or DEFAULT_JOBS_DIR, max_concurrent)
+    return _manager
@@ -0,0 +1,241 @@
+import contextvars
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import numpy as np
+from moviepy.config import get_setting
+
+def ffmpeg_binary():
+    """Returns the ffmpeg executable MoviePy is configured to use."""
+    return get_setting("FFMPEG_BINARY")
+
+def frame_count(duration, fps):
+    """Number of output frames for a slide of `duration` seconds."""
+    return max(1, int(round(duration * fps)))
+
+# Named x264 settings. Slides are mostly still images, so every profile uses
+# tune=stillimage; quality is set by CRF (constant quality) rather than bitrate.
+# 'expected' is measured with benchmarks/bench_render.py --profiles on a 12-slide
+# 1080x1920@30 reel of noisy synthetic photos (a worst case for bitrate); speed is
+# per x264 thread, so it scales with the cores.
+ENCODER_PROFILES = {
+    'draft': {
+        'label': "Draft (fastest, large files)",
+        'preset': 'ultrafast',
+        'crf': 26,
+        'tune': 'stillimage',
+        'keyint_seconds': 4,
+        'expected': {'fps_per_thread': 37, 'kbps': 4100},
+    },
+    'social': {
+        'label': "Social (balanced, upload-ready)",
+        'preset': 'fast',
+        'crf': 23,
+        'tune': 'stillimage',
+        'keyint_seconds': 2, # platforms re-encode more cleanly with regular keyframes
+        'maxrate': '8M',
+        'bufsize': '16M',
+        'expected': {'fps_per_thread': 14, 'kbps': 3100},
+    },
+    'archive': {
+        'label': "Archive (slow, best quality)",
+        'preset': 'slow',
+        'crf': 18,
+        'tune': 'stillimage',
+        'keyint_seconds': 10,
+        'expected': {'fps_per_thread': 8.3, 'kbps': 4600},
+    },
+}
+DEFAULT_ENCODER_PROFILE = 'social'
+
+def encoder_threads(concurrent=1):
+    """x264 threads per encoder when `concurrent` encoders share the machine."""
+    return max(1, (os.cpu_count() or 1) // max(1, concurrent))
+
+def default_encode_jobs():
+    """
+    Segments encoded at once in segments mode: one ffmpeg per two cores.
+    Several small x264 instances on separate slides scale better than one
+    instance with every thread, and slides are cheap to split between them.
+    """
+    return max(1, min(8, (os.cpu_count() or 1) // 2))
+
+def resolve_encoder(global_settings, concurrent=1):
+    """
+    Encoder parameters for a render: the profile named by
+    settings['encoder_profile'] with its thread count filled in from the cores.
+    """
+    name = global_settings.get('encoder_profile') or DEFAULT_ENCODER_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile: {name} (choose from {', '.join(ENCODER_PROFILES)})")
+    encoder = {k: v for k, v in ENCODER_PROFILES[name].items() if k not in ('label', 'expected')}
+    encoder['profile'] = name
+    encoder['threads'] = encoder_threads(concurrent)
+    return encoder
+
+def encoder_identity(encoder):
+    """Parameters that change the encoded bitstream (thread count does not, for cache keys)."""
+    return {k: v for k, v in encoder.items() if k != 'threads'}
+
+def x264_params(encoder, fps):
+    """Rate control, tuning and GOP options for an encoder dict (see resolve_encoder)."""
+    args = ['-crf', str(encoder['crf'])]
+    if encoder.get('tune'):
+        args += ['-tune', encoder['tune']]
+    if encoder.get('maxrate'):
+        args += ['-maxrate', encoder['maxrate'], '-bufsize', encoder.get('bufsize', encoder['maxrate'])]
+    keyint = max(1, int(round(encoder.get('keyint_seconds', 2) * fps)))
+    args += ['-g', str(keyint)]
+    return args
+
+def video_codec_args(fps, encoder=None):
+    """ffmpeg output args shared by every segment so they can be stream-copied together."""
+    encoder = encoder or resolve_encoder({})
+    return [
+        '-c:v', 'libx264',
+        '-preset', encoder['preset'],
+        '-threads', str(encoder['threads']),
+    ] + x264_params(encoder, fps) + [
+        '-pix_fmt', 'yuv420p',
+        '-r', str(fps),
+    ]
+
+def _run_ffmpeg(cmd, input_bytes=None):
+    proc = subprocess.run(cmd, input=input_bytes, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise IOError(f"ffmpeg failed ({proc.returncode}): {proc.stderr.decode(errors='replace').strip()}")
+
+def encode_still_segment(frame, duration, fps, output_path, encoder=None):
+    """
+    Encodes one RGB frame (H, W, 3 uint8) held for `duration` seconds.
+    The frame is sent to ffmpeg once and repeated by the loop filter,
+    so nothing is recomposited or piped per output frame.
+    """
+    frame = np.ascontiguousarray(frame, dtype=np.uint8)
+    h, w = frame.shape[:2]
+    n = frame_count(duration, fps)
+    cmd = [
+        ffmpeg_binary(), '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{w}x{h}', '-framerate', str(fps),
+        '-i', '-',
+        '-vf', f'loop=loop={n - 1}:size=1:start=0',
+        '-frames:v', str(n),
+        '-an',
+    ] + video_codec_args(fps, encoder) + [output_path]
+    _run_ffmpeg(cmd, frame.tobytes())
+    return output_path
+
+class _ProducerFailure:
+    def __init__(self, error):
+        self.error = error
+
+_END_OF_STREAM = object()
+
+def encode_frame_stream(frames, output_path, size, fps, encoder=None, prefetch=8, frame_callback=None):
+    """
+    Encodes an iterable of (H, W, 3) uint8 frames by piping raw RGB to ffmpeg's stdin.
+    encoder: parameters from resolve_encoder (default profile when None).
+
+    The iterable is consumed on a background thread into a queue holding at
+    most `prefetch` frames, so frame production (decode, filters, compositing)
+    overlaps with encoding while memory stays constant regardless of length.
+    frame_callback(n) is called on the calling thread after n frames are written.
+    Returns the number of frames written.
+    """
+    w, h = size
+    frame_queue = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for frame in frames:
+                if not put(frame):
+                    return
+            put(_END_OF_STREAM)
+        except BaseException as e:
+            put(_ProducerFailure(e))
+
+    cmd = [
+        ffmpeg_binary(), '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{w}x{h}', '-framerate', str(fps),
+        '-i', '-',
+        '-an',
+    ] + video_codec_args(fps, encoder) + [output_path]
+
+    # stderr goes to a file so a chatty ffmpeg can never block on a full pipe
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=err)
+        # The producer runs in a copy of this context so profiling spans follow it
+        producer = threading.Thread(target=contextvars.copy_context().run, args=(produce,),
+                                    name="frame-producer", daemon=True)
+        producer.start()
+        written = 0
+        try:
+            while True:
+                item = frame_queue.get()
+                if item is _END_OF_STREAM:
+                    break
+                if isinstance(item, _ProducerFailure):
+                    raise item.error
+                frame = np.ascontiguousarray(item, dtype=np.uint8)
+                if frame.shape != (h, w, 3):
+                    raise ValueError(f"Frame {written} has shape {frame.shape}, expected {(h, w, 3)}")
+                proc.stdin.write(frame.data)
+                written += 1
+                if frame_callback:
+                    frame_callback(written)
+            proc.stdin.close()
+            returncode = proc.wait()
+        except BrokenPipeError:
+            returncode = proc.wait()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            stop.set()
+            producer.join(timeout=5)
+
+        if returncode != 0:
+            err.seek(0)
+            raise IOError(f"ffmpeg failed ({returncode}): {err.read().decode(errors='replace').strip()}")
+    return written
+
+def concat_segments(segment_paths, output_path, temp_dir):
+    """Joins encoded segments with the concat demuxer (stream copy, no re-encode)."""
+    list_path = os.path.join(temp_dir, "segments.txt")
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    cmd = [
+        ffmpeg_binary(), '-y', '-loglevel', 'error',
+        '-f', 'concat', '-safe', '0', '-i', list_path,
+        '-c', 'copy', output_path
+    ]
+    _run_ffmpeg(cmd)
+    return output_path
+
+def mux_audio(video_path, audio_path, output_path, audio_codec='aac'):
+    """Adds an audio track to an already encoded video without touching the video stream."""
+    cmd = [
+        ffmpeg_binary(), '-y', '-loglevel', 'error',
+        '-i', video_path, '-i', audio_path,
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c:v', 'copy', '-c:a', audio_codec,
+        '-movflags', '+faststart',
+        output_path
+    ]
+    _run_ffmpeg(cmd)
+    return output_path
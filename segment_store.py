@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+from frame_cache import frame_key
+
+MANIFEST_NAME = "manifest.json"
+
+def _digest(payload):
+    blob = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=list)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+def segment_key(image_data, global_settings, encoder_params):
+    """
+    Identity of a slide's encoded segment: everything that changes its frames
+    (processed frame, caption, duration, transition, motion) plus the encoder settings.
+    """
+    return _digest({
+        'frame': frame_key(image_data, global_settings),
+        'text_overlay': image_data.get('text_overlay') or {},
+        'transition': image_data.get('transition') or {},
+        'motion': image_data.get('motion') or {},
+        'duration': float(image_data.get('duration', 3)),
+        'fps': global_settings.get('fps', 30),
+        'encoder': encoder_params,
+    })
+
+def chunk_key(slide_keys, offset=0, overlap=0):
+    """
+    Identity of a timeline chunk's segment (transitions.plan_chunks): the
+    keys of its slides plus where it starts in the first slide and how many
+    frames blend into the next. A whole slide on its own keeps its segment_key.
+    """
+    if len(slide_keys) == 1 and offset == 0:
+        return slide_keys[0]
+    return _digest({'slides': list(slide_keys), 'offset': offset, 'overlap': overlap})
+
+class SegmentStore:
+    """
+    Directory of per-slide encoded segments plus a manifest of the last render.
+    Re-exports only encode segments whose key is new, and reuse the joined
+    video when the segment list did not change at all.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def segment_path(self, key):
+        return os.path.join(self.root, f"seg_{key}.mp4")
+
+    def video_path(self, keys):
+        return os.path.join(self.root, f"video_{_digest(keys)}.mp4")
+
+    def has(self, key):
+        return os.path.exists(self.segment_path(key))
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST_NAME)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def diff(self, keys):
+        """
+        Compares a new segment list with the last render.
+        Returns {'encode': [indices], 'reuse': [indices], 'changed': [indices]};
+        'changed' lists slots whose key differs from the previous render.
+        """
+        previous = self.load_manifest().get('segments', [])
+        encode, reuse, changed = [], [], []
+        for idx, key in enumerate(keys):
+            (reuse if self.has(key) else encode).append(idx)
+            if idx >= len(previous) or previous[idx] != key:
+                changed.append(idx)
+        return {'encode': encode, 'reuse': reuse, 'changed': changed}
+
+    def commit(self, keys, stats=None):
+        """Records `keys` as the last render and deletes files it no longer references."""
+        manifest = {
+            'segments': keys,
+            'video': os.path.basename(self.video_path(keys)),
+            'last_render': stats or {},
+        }
+        tmp_path = os.path.join(self.root, MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.root, MANIFEST_NAME))
+
+        keep = {os.path.basename(self.segment_path(k)) for k in keys}
+        keep.add(manifest['video'])
+        for name in os.listdir(self.root):
+            if name.endswith(".mp4") and name not in keep:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+        return manifest
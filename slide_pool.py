@@ -0,0 +1,82 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+class SlideProcessingError(Exception):
+    """Raised when preparing a slide fails; identifies the slide by position and file."""
+
+    def __init__(self, index, path, cause):
+        self.index = index
+        self.path = path
+        self.cause = cause
+        super().__init__(f"Slide {index + 1} ({os.path.basename(path)}) failed: {cause}")
+
+def default_workers():
+    """One worker per core."""
+    return os.cpu_count() or 1
+
+def imap_slides(fn, images, global_settings, workers=None, max_in_flight=None,
+                progress_callback=None, executor=None):
+    """
+    Runs fn(image_data, global_settings) for every slide and yields
+    (index, result) in timeline order.
+
+    - workers: pool size (default: one per core); 1 runs inline without a pool.
+    - max_in_flight: cap on submitted-but-unconsumed slides, which bounds memory
+      held by pending results (default: 2 * workers).
+    - progress_callback: called with the fraction of slides finished (0..1).
+    - executor: an existing executor to reuse instead of starting a new pool.
+
+    Failures are re-raised as SlideProcessingError naming the slide.
+    """
+    total = len(images)
+    workers = workers or default_workers()
+    done = 0
+    pending = deque()
+
+    def report():
+        # Callbacks always run on the consuming thread (Streamlit widgets require it);
+        # slides finished by workers but not yet consumed count as done.
+        if progress_callback:
+            finished = done + sum(1 for _, f in pending if f.done())
+            progress_callback(finished / total)
+
+    if executor is None and (workers <= 1 or total <= 1):
+        for idx, img_data in enumerate(images):
+            try:
+                result = fn(img_data, global_settings)
+            except Exception as e:
+                raise SlideProcessingError(idx, img_data.get('path', '?'), e) from e
+            done += 1
+            report()
+            yield idx, result
+        return
+
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+    owns_executor = executor is None
+    if owns_executor:
+        executor = ProcessPoolExecutor(max_workers=min(workers, total))
+
+    try:
+        next_idx = 0
+        while next_idx < total or pending:
+            # Keep the window full
+            while next_idx < total and len(pending) < max_in_flight:
+                future = executor.submit(fn, images[next_idx], global_settings)
+                pending.append((next_idx, future))
+                next_idx += 1
+            report()
+
+            idx, future = pending.popleft()
+            try:
+                result = future.result()
+            except Exception as e:
+                raise SlideProcessingError(idx, images[idx].get('path', '?'), e) from e
+            done += 1
+            report()
+            yield idx, result
+    finally:
+        for _, future in pending:
+            future.cancel()
+        if owns_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,78 @@
+import math
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+DEFAULT_FONT = 'arial.ttf'
+
+@lru_cache(maxsize=64)
+def load_font(font, fontsize):
+    """ImageFont.truetype, cached by (font, size); falls back to Pillow's default font."""
+    try:
+        return ImageFont.truetype(font, fontsize)
+    except IOError:
+        return ImageFont.load_default()
+
+@lru_cache(maxsize=256)
+def create_text_sprite(text, fontsize, color, font=DEFAULT_FONT, subpixel=(0.0, 0.0)):
+    """
+    Renders a caption into a tightly cropped RGBA sprite.
+    Returns (sprite, bbox) where bbox is the text's bounding box relative
+    to the draw origin, as returned by ImageDraw.textbbox((0, 0), ...);
+    the sprite's top-left pixel sits at (origin + bbox[:2]).
+    subpixel: fractional part of the draw origin, so glyphs are
+    antialiased exactly as if drawn on a full-frame canvas.
+    Cached, so unchanged captions are rendered once per process.
+    """
+    font_obj = load_font(font, fontsize)
+    bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font_obj)
+
+    # Draw with the origin on the canvas (Pillow rasterizes relative to it), then crop
+    ox, oy = max(0, -bbox[0]), max(0, -bbox[1])
+    canvas = Image.new('RGBA', (ox + bbox[2] + 2, oy + bbox[3] + 2), (0, 0, 0, 0))
+    ImageDraw.Draw(canvas).text((ox + subpixel[0], oy + subpixel[1]), text, font=font_obj, fill=color)
+    sprite = canvas.crop((ox + bbox[0], oy + bbox[1], ox + bbox[2] + 2, oy + bbox[3] + 2))
+    return sprite, bbox
+
+def text_origin(bbox, image_size, align='center'):
+    """Draw origin of a caption on a frame of image_size: centered horizontally, placed vertically by align."""
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    x = (image_size[0] - text_width) / 2 # Center horizontally
+
+    if align == 'top':
+        y = image_size[1] * 0.1 # 10% from top
+    elif align == 'bottom':
+        y = image_size[1] * 0.8 # 20% from bottom
+    else: # center
+        y = (image_size[1] - text_height) / 2
+    return x, y
+
+def create_text_overlay(text_overlay, image_size):
+    """
+    Builds the caption for a slide's text_overlay dict as a cropped sprite.
+    Returns (sprite, (x, y)): the RGBA sprite and its top-left position on the frame.
+    """
+    text = text_overlay['text']
+    fontsize = int(text_overlay.get('fontsize', 50))
+    font = text_overlay.get('font', DEFAULT_FONT)
+    color = text_overlay.get('color', 'white')
+    if isinstance(color, list):
+        color = tuple(color)
+
+    _, bbox = create_text_sprite(text, fontsize, color, font)
+    x, y = text_origin(bbox, image_size, text_overlay.get('align', 'center'))
+    # Same split into whole and fractional pixels as ImageDraw.text
+    subpixel = (round(math.modf(x)[0], 3), round(math.modf(y)[0], 3))
+    sprite, _ = create_text_sprite(text, fontsize, color, font, subpixel)
+    return sprite, (int(x) + bbox[0], int(y) + bbox[1])
+
+def burn_text(img, text_overlay):
+    """
+    Composites a slide's caption into an RGB PIL image in place, touching
+    only the sprite's region. Returns the image.
+    """
+    if not text_overlay or not text_overlay.get('text'):
+        return img
+    sprite, position = create_text_overlay(text_overlay, img.size)
+    img.paste(sprite, position, sprite)
+    return img
@@ -0,0 +1,253 @@
+import numpy as np
+from PIL import Image
+from segment_encoder import frame_count
+from text_overlay import burn_text
+from profiling import span
+
+TRANSITION_TYPES = ('none', 'crossfade', 'slide')
+SLIDE_DIRECTIONS = ('left', 'right', 'up', 'down')
+DEFAULT_TRANSITION_DURATION = 0.5
+MAX_KEN_BURNS_ZOOM = 2.0
+
+def transition_of(image_data):
+    """
+    The transition into a slide from the one before it, normalized, or None:
+    {'type': 'crossfade' | 'slide', 'duration': seconds, 'direction': 'left'...}.
+    """
+    transition = image_data.get('transition') or {}
+    kind = transition.get('type', 'none')
+    if kind not in TRANSITION_TYPES or kind == 'none':
+        return None
+    duration = float(transition.get('duration', DEFAULT_TRANSITION_DURATION))
+    if duration <= 0:
+        return None
+    normalized = {'type': kind, 'duration': duration}
+    if kind == 'slide':
+        direction = transition.get('direction', 'left')
+        normalized['direction'] = direction if direction in SLIDE_DIRECTIONS else 'left'
+    return normalized
+
+def motion_of(image_data):
+    """
+    A slide's Ken Burns move, normalized, or None:
+    {'zoom_start', 'zoom_end'} (1.0 = fit) and pan from (x_start, y_start) to
+    (x_end, y_end), each in -1..1 across the room the zoom leaves.
+    """
+    motion = image_data.get('motion') or {}
+    if motion.get('type') != 'kenburns':
+        return None
+    clamp_zoom = lambda z: min(MAX_KEN_BURNS_ZOOM, max(1.0, float(z)))
+    clamp_pan = lambda p: min(1.0, max(-1.0, float(p)))
+    normalized = {
+        'zoom_start': clamp_zoom(motion.get('zoom_start', 1.0)),
+        'zoom_end': clamp_zoom(motion.get('zoom_end', 1.2)),
+        'x_start': clamp_pan(motion.get('x_start', 0.0)),
+        'y_start': clamp_pan(motion.get('y_start', 0.0)),
+        'x_end': clamp_pan(motion.get('x_end', 0.0)),
+        'y_end': clamp_pan(motion.get('y_end', 0.0)),
+    }
+    if normalized['zoom_start'] == normalized['zoom_end'] == 1.0:
+        return None # nothing can move at 1x
+    return normalized
+
+def motion_oversample(image_data):
+    """How much larger than the output a Ken Burns slide is prepared, so zooming in never upsamples."""
+    motion = motion_of(image_data)
+    if motion is None:
+        return 1.0
+    return max(motion['zoom_start'], motion['zoom_end'])
+
+def source_settings(image_data, global_settings):
+    """Settings to prepare a slide's source frame with (oversampled resolution for Ken Burns slides)."""
+    scale = motion_oversample(image_data)
+    if scale == 1.0:
+        return global_settings
+    w, h = global_settings.get('resolution', (1080, 1920))
+    return dict(global_settings, resolution=(int(round(w * scale)), int(round(h * scale))))
+
+def plan_timeline(images, fps):
+    """
+    Frame layout of the reel. Each transition overlaps the end of the previous
+    slide with the start of the next, so the reel gets shorter by its length.
+    Returns (slots, total_frames); slots[i] = {'start', 'frames', 'overlap'}
+    where overlap is the number of frames shared with slide i - 1.
+    Overlaps are clamped so no more than two slides are ever on screen.
+    """
+    slots = []
+    position = 0
+    for idx, image_data in enumerate(images):
+        frames = frame_count(image_data.get('duration', 3), fps)
+        overlap = 0
+        transition = transition_of(image_data)
+        if idx > 0 and transition:
+            prev = slots[-1]
+            room = prev['frames'] - prev['overlap'] # frames of prev not already blending with its own predecessor
+            overlap = max(0, min(frame_count(transition['duration'], fps), room - 1, frames - 1))
+        start = position - overlap
+        slots.append({'start': start, 'frames': frames, 'overlap': overlap})
+        position = start + frames
+    return slots, position
+
+def timeline_duration(images, fps):
+    """Length of the reel in seconds, transitions included."""
+    return plan_timeline(images, fps)[1] / fps
+
+def plan_chunks(images, slots):
+    """
+    Splits the timeline at slide boundaries into independently renderable
+    chunks, one per slide: its frames from the end of the incoming transition
+    up to the end of the slide, so a chunk also holds the transition into the
+    next slide. Returns [{'slides': [i] or [i, i + 1], 'start', 'frames',
+    'offset', 'overlap'}] where offset is the first frame of slide i in the
+    chunk and overlap the frames blended with slide i + 1 (0 without one).
+    Chunks tile the timeline exactly, so they can be encoded in parallel and
+    joined in order.
+    """
+    chunks = []
+    for idx, slot in enumerate(slots):
+        overlap = slots[idx + 1]['overlap'] if idx + 1 < len(slots) else 0
+        chunks.append({
+            'slides': [idx, idx + 1] if overlap else [idx],
+            'start': slot['start'] + slot['overlap'],
+            'frames': slot['frames'] - slot['overlap'],
+            'offset': slot['overlap'],
+            'overlap': overlap,
+        })
+    return chunks
+
+def is_static_slide(image_data):
+    """Every frame of the slide itself is identical: no Ken Burns move and no animated text."""
+    text_overlay = image_data.get('text_overlay') or {}
+    return motion_of(image_data) is None and not text_overlay.get('animation')
+
+def is_static_chunk(images, chunk):
+    """A static slide without an outgoing transition: encoded from a single frame."""
+    return len(chunk['slides']) == 1 and is_static_slide(images[chunk['slides'][0]])
+
+def still_frames(images, chunk):
+    """
+    Leading frames of a chunk that all show the same still: every frame of a
+    static chunk, the frames before the outgoing transition of a static slide,
+    otherwise none.
+    """
+    if not is_static_slide(images[chunk['slides'][0]]):
+        return 0
+    return chunk['frames'] - chunk['overlap']
+
+class SlideLayer:
+    """
+    Produces one slide's frames. Still slides return the same caption-burned
+    array every frame; Ken Burns slides resample a window of the oversampled
+    source (one bilinear resize per frame, done in C) and burn the caption on top.
+    """
+
+    def __init__(self, image_data, global_settings, source, frames):
+        self.size = tuple(global_settings.get('resolution', (1080, 1920)))
+        self.text_overlay = image_data.get('text_overlay') or {}
+        self.motion = motion_of(image_data)
+        self.frames = frames
+        if self.motion is None:
+            self.still = np.asarray(source)
+            if self.text_overlay.get('text'):
+                with span('burn_text'):
+                    self.still = np.asarray(burn_text(Image.fromarray(self.still), self.text_overlay))
+        else:
+            self.source = Image.fromarray(np.asarray(source))
+            self.still = None
+
+    def view_box(self, j):
+        """Source window shown at local frame j."""
+        m = self.motion
+        p = j / max(1, self.frames - 1)
+        zoom = m['zoom_start'] + (m['zoom_end'] - m['zoom_start']) * p
+        pan_x = m['x_start'] + (m['x_end'] - m['x_start']) * p
+        pan_y = m['y_start'] + (m['y_end'] - m['y_start']) * p
+
+        # The source is oversampled by the largest zoom, so at that zoom the
+        # window maps 1:1 onto output pixels and it never needs upsampling
+        src_w, src_h = self.source.size
+        view_w = src_w / zoom
+        view_h = src_h / zoom
+        cx = src_w / 2 + pan_x * (src_w - view_w) / 2
+        cy = src_h / 2 + pan_y * (src_h - view_h) / 2
+        return (cx - view_w / 2, cy - view_h / 2, cx + view_w / 2, cy + view_h / 2)
+
+    def frame(self, j):
+        if self.still is not None:
+            return self.still
+        with span('kenburns_frame'):
+            img = self.source.resize(self.size, Image.BILINEAR, box=self.view_box(j))
+            return np.asarray(burn_text(img, self.text_overlay))
+
+def crossfade(a, b, alpha):
+    """a * (1 - alpha) + b * alpha for uint8 frames, computed in float32."""
+    out = b.astype(np.float32)
+    out -= a
+    out *= alpha
+    out += a
+    out += 0.5 # round instead of truncate
+    return out.astype(np.uint8)
+
+def push(a, b, progress, direction):
+    """
+    Slide transition: b pushes a out of frame towards `direction`.
+    Pure slice copies, no per-pixel arithmetic.
+    """
+    h, w = a.shape[:2]
+    out = np.empty_like(a)
+    if direction in ('left', 'right'):
+        shift = int(round(w * progress))
+        if direction == 'left':
+            out[:, :w - shift] = a[:, shift:]
+            out[:, w - shift:] = b[:, :shift]
+        else:
+            out[:, shift:] = a[:, :w - shift]
+            out[:, :shift] = b[:, w - shift:]
+    else:
+        shift = int(round(h * progress))
+        if direction == 'up':
+            out[:h - shift] = a[shift:]
+            out[h - shift:] = b[:shift]
+        else:
+            out[shift:] = a[:h - shift]
+            out[:shift] = b[h - shift:]
+    return out
+
+def ease(p):
+    """Smoothstep, so slides start and stop gently."""
+    return p * p * (3 - 2 * p)
+
+class ChunkRenderer:
+    """
+    Random-access frames of one chunk (see plan_chunks). Only the frames
+    where the next slide overlaps are blended; every other frame comes
+    straight from the slide's layer.
+    """
+
+    def __init__(self, images, chunk, layers):
+        self.frames = chunk['frames']
+        self.offset = chunk['offset']
+        self.layer = layers[chunk['slides'][0]]
+        self.blend_from = self.frames - chunk['overlap'] # first blended frame
+        self.overlap = chunk['overlap']
+        if self.overlap:
+            self.next_layer = layers[chunk['slides'][1]]
+            self.transition = transition_of(images[chunk['slides'][1]])
+
+    def frame(self, k):
+        if not 0 <= k < self.frames:
+            raise IndexError(f"Frame {k} is outside the chunk ({self.frames} frames)")
+        a = self.layer.frame(self.offset + k)
+        if k < self.blend_from:
+            return a
+        j = k - self.blend_from # frame of the next slide
+        b = self.next_layer.frame(j)
+        progress = (j + 1) / (self.overlap + 1)
+        with span('transition_frame', kind=self.transition['type']):
+            if self.transition['type'] == 'slide':
+                return push(a, b, ease(progress), self.transition['direction'])
+            return crossfade(a, b, progress)
+
+    def __iter__(self):
+        for k in range(self.frames):
+            yield self.frame(k)
@@ -1,17 +1,136 @@
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+from PIL import Image, ImageFilter
 import numpy as np
+from profiling import span
+from image_loader import load_image, image_info, exif_orientation, oriented_size # noqa: F401 (re-exported)
 
 def hex_to_rgb(hex_color):
     """Converts hex color string to RGB tuple."""
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
-def apply_image_filters(image, filters):
+# ITU-R 601-2 luma weights, as used by PIL's "L" conversion
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+SEPIA_MATRIX = np.array([
+    [0.393, 0.769, 0.189],
+    [0.349, 0.686, 0.168],
+    [0.272, 0.534, 0.131]
+], dtype=np.float32)
+
+# Exact equivalents of rotate(-angle, expand=True) for right angles
+RIGHT_ANGLE_TRANSPOSE = {
+    90: Image.Transpose.ROTATE_270,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90,
+}
+
+def rotate_image(img, angle):
+    """Clockwise rotation; right angles use a lossless transpose."""
+    angle = angle % 360
+    if angle in RIGHT_ANGLE_TRANSPOSE:
+        return img.transpose(RIGHT_ANGLE_TRANSPOSE[angle])
+    return img.rotate(-angle, expand=True) # Negative for clockwise
+
+def _tone_lut(img, filters, luma_histogram=None):
+    """
+    Builds the float32 256-entry LUT for brightness -> contrast -> gamma.
+    Returns None when all three are neutral. luma_histogram overrides the
+    histogram the contrast mean is taken from.
+    """
+    brightness = filters.get('brightness', 1.0)
+    contrast = filters.get('contrast', 1.0)
+    gamma = filters.get('gamma', 1.0)
+    if brightness == 1.0 and contrast == 1.0 and gamma == 1.0:
+        return None
+
+    lut = np.arange(256, dtype=np.float32)
+    if brightness != 1.0:
+        # ImageEnhance.Brightness: blend with black, truncated to uint8
+        lut = np.clip(np.floor(lut * brightness), 0, 255)
+    if contrast != 1.0:
+        # ImageEnhance.Contrast blends with the mean luma; derive that mean from
+        # the luma histogram mapped through the LUT so far (no extra full pass)
+        hist = np.asarray(luma_histogram or img.convert('L').histogram(), dtype=np.float64)
+        mean = int((hist * lut).sum() / max(hist.sum(), 1) + 0.5)
+        lut = np.clip(np.floor(mean + contrast * (lut - mean)), 0, 255)
+    if gamma != 1.0:
+        lut = np.round(255.0 * (lut / 255.0) ** (1.0 / gamma))
+    return lut.astype(np.float32)
+
+def _saturation_matrix(saturation):
+    """ImageEnhance.Color as a 3x3 matrix: L + s * (x - L)."""
+    return (saturation * np.eye(3, dtype=np.float32)
+            + (1.0 - saturation) * np.outer(np.ones(3, dtype=np.float32), LUMA))
+
+def _effect_affine(filters):
+    """
+    Folds grayscale -> invert -> sepia into one affine map (matrix, offset),
+    or None when none of them is enabled.
+    """
+    matrix = np.eye(3, dtype=np.float32)
+    offset = np.zeros(3, dtype=np.float32)
+    active = False
+    if filters.get('grayscale'):
+        gray = np.outer(np.ones(3, dtype=np.float32), LUMA)
+        matrix, offset = gray @ matrix, gray @ offset
+        active = True
+    if filters.get('invert'):
+        matrix, offset = -matrix, 255.0 - offset
+        active = True
+    if filters.get('sepia'):
+        matrix, offset = SEPIA_MATRIX @ matrix, SEPIA_MATRIX @ offset
+        active = True
+    if not active:
+        return None
+    return matrix, offset
+
+def _apply_color_pass(img, lut=None, affines=()):
+    """
+    Applies a tone LUT and then a chain of clipped affine colour maps to an
+    RGB image. Each step is a single C-level pass (Image.point for the LUT,
+    the float32 matrix convert for each affine), so no per-enhancer copies
+    or float64 intermediates are allocated.
+    """
+    if lut is not None:
+        table = np.clip(lut, 0, 255).astype(np.uint8)
+        img = img.point(np.tile(table, 3).tolist())
+    for matrix, offset in affines:
+        coeffs = np.hstack([matrix, offset[:, None]]).astype(np.float64).ravel()
+        img = img.convert('RGB', matrix=tuple(coeffs))
+    return img
+
+def _sharpness_kernel(factor):
+    """
+    ImageEnhance.Sharpness blends the image with its SMOOTH-filtered copy;
+    folding that blend into the 3x3 kernel makes it a single convolution.
+    """
+    smooth = np.array([1, 1, 1, 1, 5, 1, 1, 1, 1], dtype=np.float64) / 13.0
+    identity = np.zeros(9)
+    identity[4] = 1.0
+    weights = (1.0 - factor) * smooth + factor * identity
+    return ImageFilter.Kernel((3, 3), weights.tolist(), scale=1)
+
+def _point_effect_lut(filters):
+    """posterize -> solarize as a single uint8 LUT, or None."""
+    if not filters.get('posterize') and not filters.get('solarize'):
+        return None
+    lut = np.arange(256, dtype=np.uint8)
+    if filters.get('posterize'):
+        # Posterize requires integer bits 1-8
+        bits = int(filters.get('posterize_bits', 4))
+        lut = lut & np.uint8(~(2 ** (8 - bits) - 1) & 0xFF)
+    if filters.get('solarize'):
+        threshold = filters.get('solarize_threshold', 128)
+        lut = np.where(lut < threshold, lut, 255 - lut).astype(np.uint8)
+    return lut
+
+def apply_image_filters(image, filters, luma_histogram=None):
     """
     Applies a dictionary of filters to a PIL Image.
     filters dict keys:
         - brightness (float, default 1.0)
         - contrast (float, default 1.0)
+        - gamma (float, default 1.0; >1 brightens midtones)
         - saturation (float, default 1.0)
         - sharpness (float, default 1.0)
         - grayscale (bool)
@@ -20,130 +139,244 @@ def apply_image_filters(image, filters):
         - blur (float, radius)
         - emboss (bool)
         - rotate (int)
+
+    Point operations are fused: brightness/contrast/gamma become one LUT,
+    saturation and grayscale/invert/sepia become single 3x4 colour matrix
+    passes, and posterize/solarize one final LUT.
+    Output matches the previous chain of ImageEnhance/ImageOps passes to
+    within 2 levels per channel (see benchmarks/bench_filters.py).
+    luma_histogram: histogram of the whole picture when image is a crop of
+    it, so contrast keeps blending with the picture's mean luma.
     """
-    img = image.copy()
+    img = image
+    alpha = None
+    if img.mode == 'RGBA':
+        alpha = img.getchannel('A')
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
 
     # Transformations
     if filters.get('rotate'):
-        img = img.rotate(-filters['rotate'], expand=True) # Negative for clockwise
-
-    # Color Enhancements
-    if filters.get('brightness', 1.0) != 1.0:
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(filters['brightness'])
-    
-    if filters.get('contrast', 1.0) != 1.0:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(filters['contrast'])
+        with span('filter.rotate', 'filters'):
+            img = rotate_image(img, filters['rotate'])
+            if alpha is not None:
+                alpha = rotate_image(alpha, filters['rotate'])
 
+    # Tone + saturation (before sharpening, as ImageEnhance ordered them)
+    lut = _tone_lut(img, filters, luma_histogram)
+    affines = []
     if filters.get('saturation', 1.0) != 1.0:
-        enhancer = ImageEnhance.Color(img)
-        img = enhancer.enhance(filters['saturation'])
+        affines.append((_saturation_matrix(filters['saturation']), np.zeros(3, dtype=np.float32)))
 
-    if filters.get('sharpness', 1.0) != 1.0:
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(filters['sharpness'])
+    effects = _effect_affine(filters)
+    sharpen = filters.get('sharpness', 1.0) != 1.0
+    invert_only = filters.get('invert') and not filters.get('grayscale') and not filters.get('sepia')
+    if invert_only and not sharpen and not affines:
+        # A lone invert is a point op too: fold it into the tone LUT
+        lut = 255.0 - (lut if lut is not None else np.arange(256, dtype=np.float32))
+        effects = None
+    if effects is not None and not sharpen:
+        # Nothing spatial in between: grayscale/invert/sepia join the same pass
+        affines.append(effects)
+        effects = None
 
-    # Effects
-    if filters.get('grayscale'):
-        img = ImageOps.grayscale(img).convert("RGB") # Keep as RGB for consistency
-    
-    if filters.get('invert'):
-        if img.mode == 'RGBA':
-            r,g,b,a = img.split()
-            rgb_image = Image.merge('RGB', (r,g,b))
-            inverted_image = ImageOps.invert(rgb_image)
-            r2,g2,b2 = inverted_image.split()
-            img = Image.merge('RGBA', (r2,g2,b2,a))
-        else:
-            img = ImageOps.invert(img)
+    if lut is not None or affines:
+        with span('filter.color', 'filters', passes=len(affines) + (lut is not None)):
+            img = _apply_color_pass(img, lut, affines)
 
-    if filters.get('sepia'):
-        sepia_filter = np.array([
-            [0.393, 0.769, 0.189],
-            [0.349, 0.686, 0.168],
-            [0.272, 0.534, 0.131]
-        ])
-        img_np = np.array(img)
-        sepia_img = img_np.dot(sepia_filter.T)
-        sepia_img /= 255.0
-        sepia_img = np.clip(sepia_img, 0, 1) * 255
-        img = Image.fromarray(sepia_img.astype('uint8'))
+    if sharpen:
+        with span('filter.sharpness', 'filters'):
+            img = img.filter(_sharpness_kernel(filters['sharpness']))
+
+    if effects is not None:
+        with span('filter.effects', 'filters'):
+            img = _apply_color_pass(img, None, [effects])
 
+    if img is image:
+        img = img.copy()
+
+    # Spatial effects
     if filters.get('blur', 0) > 0:
-        img = img.filter(ImageFilter.GaussianBlur(radius=filters['blur']))
-
-    if filters.get('emboss'):
-        img = img.filter(ImageFilter.EMBOSS)
-    
-    if filters.get('contour'):
-        img = img.filter(ImageFilter.CONTOUR)
-
-    if filters.get('detail'):
-        img = img.filter(ImageFilter.DETAIL)
-    
-    if filters.get('edge_enhance'):
-        img = img.filter(ImageFilter.EDGE_ENHANCE)
-        
-    if filters.get('posterize'):
-        # Posterize requires integer bits 1-8
-        bits = filters.get('posterize_bits', 4)
-        img = ImageOps.posterize(img, bits)
-        
-    if filters.get('solarize'):
-        threshold = filters.get('solarize_threshold', 128)
-        img = ImageOps.solarize(img, threshold)
+        with span('filter.blur', 'filters', radius=filters['blur']):
+            img = img.filter(ImageFilter.GaussianBlur(radius=filters['blur']))
+
+    for name, kernel in (('emboss', ImageFilter.EMBOSS), ('contour', ImageFilter.CONTOUR),
+                         ('detail', ImageFilter.DETAIL), ('edge_enhance', ImageFilter.EDGE_ENHANCE)):
+        if filters.get(name):
+            with span(f'filter.{name}', 'filters'):
+                img = img.filter(kernel)
+
+    point_lut = _point_effect_lut(filters)
+    if point_lut is not None:
+        with span('filter.posterize_solarize', 'filters'):
+            img = img.point(np.tile(point_lut, 3).tolist())
 
+    if alpha is not None:
+        img.putalpha(alpha)
     return img
 
-def resize_image_for_video(image, target_size, fit_method='contain', bg_color=(0,0,0)):
+def fit_size(img_size, target_size, fit_method='contain'):
     """
-    Resizes image to target_size (width, height).
-    fit_method: 'contain' (add padding), 'cover' (crop), 'stretch'
+    Size an image of img_size is resized to before it is cropped ('cover')
+    or padded ('contain') to target_size.
     """
-    img = image.copy()
     target_w, target_h = target_size
-    img_w, img_h = img.size
-    
+    img_w, img_h = img_size
+
     if fit_method == 'stretch':
-        return img.resize(target_size, Image.LANCZOS)
-    
+        return target_size
+
     # Calculate aspect ratios
     target_aspect = target_w / target_h
     img_aspect = img_w / img_h
 
     if fit_method == 'cover':
         if img_aspect > target_aspect: # Image is wider than target
-            new_h = target_h
-            new_w = int(new_h * img_aspect)
-        else: # Image is taller than target
-            new_w = target_w
-            new_h = int(new_w / img_aspect)
-        
-        img = img.resize((new_w, new_h), Image.LANCZOS)
-        
-        # Center crop
-        left = (new_w - target_w) / 2
-        top = (new_h - target_h) / 2
-        right = (new_w + target_w) / 2
-        bottom = (new_h + target_h) / 2
-        img = img.crop((left, top, right, bottom))
-        return img
-
-    elif fit_method == 'contain':
+            return int(target_h * img_aspect), target_h
+        return target_w, int(target_w / img_aspect) # Image is taller than target
+
+    if fit_method == 'contain':
         if img_aspect > target_aspect: # Image is wider
-            new_w = target_w
-            new_h = int(new_w / img_aspect)
-        else: # Image is taller
-            new_h = target_h
-            new_w = int(new_h * img_aspect)
-            
-        img = img.resize((new_w, new_h), Image.LANCZOS)
-        
+            return target_w, int(target_w / img_aspect)
+        return int(target_h * img_aspect), target_h # Image is taller
+
+    return img_size
+
+def center_crop_box(img_size, target_size, margin=0):
+    """Box that center-crops img_size to target_size, grown by `margin` pixels where possible."""
+    img_w, img_h = img_size
+    target_w, target_h = target_size
+    left = max(0, (img_w - target_w) / 2 - margin)
+    top = max(0, (img_h - target_h) / 2 - margin)
+    right = min(img_w, (img_w + target_w) / 2 + margin)
+    bottom = min(img_h, (img_h + target_h) / 2 + margin)
+    return (left, top, right, bottom)
+
+def finish_fit(img, target_size, fit_method='contain', bg_color=(0,0,0)):
+    """Crops or pads an already resized image (see fit_size) to exactly target_size."""
+    if fit_method == 'cover':
+        return img.crop(center_crop_box(img.size, target_size))
+
+    if fit_method == 'contain':
         # Create background
+        target_w, target_h = target_size
+        new_w, new_h = img.size
         bg = Image.new('RGB', target_size, bg_color)
         offset = ((target_w - new_w) // 2, (target_h - new_h) // 2)
         bg.paste(img, offset)
         return bg
 
     return img
+
+def resize_image_for_video(image, target_size, fit_method='contain', bg_color=(0,0,0)):
+    """
+    Resizes image to target_size (width, height).
+    fit_method: 'contain' (add padding), 'cover' (crop), 'stretch'
+    """
+    new_size = fit_size(image.size, target_size, fit_method)
+    if new_size == image.size:
+        img = image.copy()
+    else:
+        img = image.resize(new_size, Image.LANCZOS)
+    return finish_fit(img, target_size, fit_method, bg_color)
+
+def rotated_size(size, angle):
+    """Size of an image after rotate_image(angle)."""
+    if (angle or 0) % 180 == 90:
+        return size[1], size[0]
+    return size
+
+def plan_slide_pipeline(src_size, filters, target_size, fit_method='contain'):
+    """
+    Decides the cheapest order of operations for a slide.
+
+    Filters used to run on the full-resolution source before the resize to
+    target_size. When the slide is downscaled, the planner moves the
+    geometric reduction first and rescales size-dependent parameters (blur
+    radius) so the result looks the same. 3x3 effects (emboss, contour,
+    detail, edge enhance, sharpness) are per-pixel and cannot be rescaled;
+    they now act at output resolution.
+
+    Returns a dict:
+        - downscale_first: whether to resize before filtering
+        - scale: output pixels per source pixel
+        - draft_size: size to request from the JPEG decoder (source orientation)
+        - resize_size: size to resize to, in source orientation
+        - crop_margin: extra pixels kept around a 'cover' crop for blur
+        - filters: filters to apply after the resize
+    """
+    angle = (filters.get('rotate') or 0) % 360
+    upright_size = rotated_size(src_size, angle)
+    scaled_size = fit_size(upright_size, target_size, fit_method)
+    scale = min(scaled_size[0] / upright_size[0], scaled_size[1] / upright_size[1])
+
+    plan = {
+        'downscale_first': scale < 1.0 and angle % 90 == 0,
+        'scale': scale,
+        'draft_size': None,
+        'resize_size': None,
+        'crop_margin': 0,
+        'filters': filters,
+    }
+    if not plan['downscale_first']:
+        return plan
+
+    plan['resize_size'] = rotated_size(scaled_size, angle)
+    plan['draft_size'] = plan['resize_size']
+
+    scaled_filters = dict(filters)
+    if filters.get('blur', 0) > 0:
+        scaled_filters['blur'] = filters['blur'] * scale
+        if fit_method == 'cover':
+            # Keep enough context around the crop for the blur kernel
+            plan['crop_margin'] = int(3 * scaled_filters['blur']) + 2
+    plan['filters'] = scaled_filters
+    return plan
+
+def process_image_for_video(img, filters, target_size, fit_method='contain', bg_color=(0,0,0), plan=None):
+    """
+    Filters and fits an already opened image to target_size following
+    plan_slide_pipeline (downscaled slides are reduced before any filter runs).
+    """
+    if plan is None:
+        plan = plan_slide_pipeline(img.size, filters, target_size, fit_method)
+
+    if not plan['downscale_first']:
+        with span('filters', size=list(img.size)):
+            img = apply_image_filters(img.convert('RGB'), filters)
+        with span('resize'):
+            return resize_image_for_video(img, target_size, fit_method, bg_color)
+
+    with span('resize', size=list(img.size), to=list(plan['resize_size'])):
+        img = img.convert('RGB')
+        if img.size != plan['resize_size']:
+            img = img.resize(plan['resize_size'], Image.LANCZOS, reducing_gap=3.0)
+
+        scaled_filters = plan['filters']
+        if scaled_filters.get('rotate'):
+            img = rotate_image(img, scaled_filters['rotate'])
+            scaled_filters = dict(scaled_filters, rotate=0)
+
+        # Contrast blends with the mean luma of the whole picture, as it did
+        # before the crop moved ahead of the filters
+        luma_histogram = None
+        if fit_method == 'cover':
+            if scaled_filters.get('contrast', 1.0) != 1.0:
+                luma_histogram = img.convert('L').histogram()
+            img = img.crop(center_crop_box(img.size, target_size, plan['crop_margin']))
+
+    with span('filters', size=list(img.size)):
+        img = apply_image_filters(img, scaled_filters, luma_histogram)
+    with span('fit'):
+        return finish_fit(img, target_size, fit_method, bg_color)
+
+def load_image_for_video(path, filters, target_size, fit_method='contain', bg_color=(0,0,0)):
+    """
+    Opens, filters and fits an image file to target_size. EXIF orientation
+    is applied, and JPEGs are DCT-scaled at decode time via draft() when
+    the slide is downscaled. Decodes come from image_loader's cache, so
+    re-processing a source (e.g. after a filter change) skips the decode.
+    """
+    plan = plan_slide_pipeline(image_info(path)['size'], filters, target_size, fit_method)
+    img = load_image(path, plan['draft_size'] if plan['downscale_first'] else None)
+    return process_image_for_video(img, filters, target_size, fit_method, bg_color, plan)
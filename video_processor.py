@@ -1,91 +1,386 @@
+import contextvars
 import tempfile
 import os
-from moviepy.editor import ImageClip, concatenate_videoclips, AudioFileClip, CompositeVideoClip, vfx
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from moviepy.editor import ImageClip, VideoClip, concatenate_videoclips, AudioFileClip
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-from utils import apply_image_filters, resize_image_for_video, hex_to_rgb
-
-def create_text_image(text, fontsize, color, font='arial.ttf', image_size=(100, 100), align='center'):
-    """Creates a transparent image with text using Pillow (avoids ImageMagick dependency)."""
-    # Create a dummy image to calculate text size
-    dummy_img = Image.new('RGBA', (1, 1), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(dummy_img)
-    
-    try:
-        font_obj = ImageFont.truetype(font, fontsize)
-    except IOError:
-        font_obj = ImageFont.load_default()
-
-    bbox = draw.textbbox((0, 0), text, font=font_obj)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-    
-    # Create the actual image
-    img = Image.new('RGBA', image_size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
-    
-    # Calculate position
-    x = (image_size[0] - text_width) / 2 # Center horizontally
-    
-    if align == 'top':
-        y = image_size[1] * 0.1 # 10% from top
-    elif align == 'bottom':
-        y = image_size[1] * 0.8 # 20% from bottom
-    else: # center
-        y = (image_size[1] - text_height) / 2
-    
-    draw.text((x, y), text, font=font_obj, fill=color)
-    return img
+from utils import load_image_for_video, hex_to_rgb
+from frame_cache import get_frame_cache, frame_key
+from slide_pool import imap_slides, SlideProcessingError
+from segment_store import SegmentStore, segment_key, chunk_key
+from segment_encoder import (encode_still_segment, encode_frame_stream, concat_segments, mux_audio,
+                             resolve_encoder, encoder_identity, x264_params, default_encode_jobs)
+from transitions import (plan_timeline, plan_chunks, is_static_chunk, still_frames, source_settings,
+                         SlideLayer, ChunkRenderer)
+from audio_processor import prepare_audio_track, release_audio_track
+from profiling import Profiler, span, collect_spans, merge_spans, trace_path_for
 
-def create_clip_from_data(image_data, global_settings, temp_dir):
-    """
-    Creates a MoviePy clip from a single image data dict.
-    image_data: dict containing 'path', 'filters', 'duration', 'text_overlay'
-    """
-    image_path = image_data['path']
-    filters = image_data.get('filters', {})
-    duration = image_data.get('duration', 3)
-    text_overlay = image_data.get('text_overlay', {})
-    
-    # Load and process image
-    pil_img = Image.open(image_path).convert('RGB')
-    pil_img = apply_image_filters(pil_img, filters)
-    
-    # Resize
+def process_slide_image(image_data, global_settings):
+    """Loads, filters and resizes a slide's source image. Returns a PIL RGB image at the target resolution."""
     target_res = global_settings.get('resolution', (1080, 1920))
     bg_color = hex_to_rgb(global_settings.get('bg_color', '#000000'))
     fit_method = global_settings.get('fit_method', 'contain')
+
+    return load_image_for_video(image_data['path'], image_data.get('filters', {}), target_res, fit_method, bg_color)
+
+def load_processed_frame(image_data, global_settings, cache_stats=None):
+    """
+    Returns the filtered and resized slide as an (H, W, 3) uint8 array,
+    served from the persistent frame cache when the same source, filters
+    and output settings were processed before.
+    cache_stats: optional {'hits', 'misses'} counters to update.
+    """
+    if not global_settings.get('frame_cache', True):
+        return np.asarray(process_slide_image(image_data, global_settings))
+
+    cache = get_frame_cache(global_settings.get('cache_dir'), global_settings.get('cache_max_bytes'))
+    with span('frame_cache.lookup') as lookup:
+        key = frame_key(image_data, global_settings)
+        frame = cache.get(key)
+        lookup.set(hit=frame is not None)
+    if cache_stats is not None:
+        cache_stats['hits' if frame is not None else 'misses'] += 1
+    if frame is None:
+        frame = np.asarray(process_slide_image(image_data, global_settings))
+        with span('frame_cache.store'):
+            cache.put(key, frame)
+    return frame
+
+def load_source_frame(image_data, global_settings, cache_stats=None):
+    """
+    The processed frame the transition engine works from: the slide at the
+    output resolution, or oversampled for Ken Burns slides (see transitions.py).
+    """
+    return load_processed_frame(image_data, source_settings(image_data, global_settings), cache_stats)
+
+def _prepare_slide(image_data, global_settings):
+    cache_stats = {'hits': 0, 'misses': 0}
+    with span('prepare_slide', path=os.path.basename(image_data['path'])):
+        frame = load_source_frame(image_data, global_settings, cache_stats)
+    if global_settings.get('frame_cache', True):
+        return None, cache_stats
+    return np.ascontiguousarray(frame), cache_stats
+
+def _prepare_slide_job(image_data, global_settings):
+    """
+    Pool entry point: processes one slide. With the frame cache enabled the
+    frame is left in the cache (cheap to hand back); otherwise it is returned.
+    Returns ((frame or None, the worker's frame cache hits/misses),
+    trace events recorded in the worker or None).
+    """
+    if global_settings.get('profile'):
+        return collect_spans(_prepare_slide, image_data, global_settings)
+    return _prepare_slide(image_data, global_settings), None
+
+def iter_prepared_slides(images, global_settings, progress_callback=None, executor=None, cache_stats=None):
+    """
+    Prepares slides on a process pool (settings 'workers' / 'max_in_flight')
+    and yields (index, source_frame) in timeline order.
+    cache_stats: optional {'hits', 'misses'} counters, summed over the
+    workers' frame cache lookups (the main process only re-reads entries).
+    """
+    results = imap_slides(
+        _prepare_slide_job,
+        images,
+        global_settings,
+        workers=global_settings.get('workers'),
+        max_in_flight=global_settings.get('max_in_flight'),
+        progress_callback=progress_callback,
+        executor=executor
+    )
+    for idx, ((frame, worker_stats), events) in results:
+        merge_spans(events)
+        if cache_stats is not None:
+            for name, count in worker_stats.items():
+                cache_stats[name] += count
+        if frame is None:
+            frame = load_source_frame(images[idx], global_settings)
+        yield idx, frame
+
+def iter_chunk_renderers(images, global_settings, chunks, progress_callback=None, executor=None, cache_stats=None):
+    """
+    Prepares the slides used by `chunks` (from transitions.plan_chunks) and
+    yields (chunk, ChunkRenderer) in order, each as soon as its slides are
+    ready. A slide's layer is dropped once the last chunk using it is out.
+    cache_stats: see iter_prepared_slides.
+    """
+    slots, _ = plan_timeline(images, global_settings.get('fps', 30))
+    last_use = {}
+    for pos, chunk in enumerate(chunks):
+        for idx in chunk['slides']:
+            last_use[idx] = pos
+    members = sorted(last_use)
+
+    layers = {}
+    next_chunk = 0
+    try:
+        for pos, frame in iter_prepared_slides([images[idx] for idx in members], global_settings,
+                                               progress_callback, executor, cache_stats):
+            idx = members[pos]
+            layers[idx] = SlideLayer(images[idx], global_settings, frame, slots[idx]['frames'])
+            while next_chunk < len(chunks) and chunks[next_chunk]['slides'][-1] <= idx:
+                chunk = chunks[next_chunk]
+                yield chunk, ChunkRenderer(images, chunk, layers)
+                for i in chunk['slides']:
+                    if last_use[i] == next_chunk:
+                        del layers[i]
+                next_chunk += 1
+    except SlideProcessingError as e:
+        # Only the slides of `chunks` went to the pool: report the timeline position
+        raise SlideProcessingError(members[e.index], e.path, e.cause) from e.cause
+
+def create_chunk_clip(renderer, fps):
+    """MoviePy clip of a timeline chunk with motion or a transition, drawn by the transition engine."""
+    last = renderer.frames - 1
+    make_frame = lambda t: renderer.frame(min(last, int(t * fps + 1e-6)))
+    return VideoClip(make_frame, duration=renderer.frames / fps)
+
+def _render_compose(images, settings, audio_config, output_path, temp_dir, progress_callback, executor=None):
+    """Legacy path: every slide becomes a MoviePy clip and all frames are composited in Python."""
+    fps = settings.get('fps', 30)
+    chunks = plan_chunks(images, plan_timeline(images, fps)[0])
+    clips = []
+    def prep_progress(p):
+        if progress_callback:
+            progress_callback(p * 0.5) # 50% for clip creation
+
+    for chunk, renderer in iter_chunk_renderers(images, settings, chunks, prep_progress, executor):
+        with span('create_clip', slide=chunk['slides'][0]):
+            if is_static_chunk(images, chunk):
+                # Caption already burned in, so nothing is composited per frame
+                clips.append(ImageClip(renderer.frame(0)).set_duration(renderer.frames / fps))
+            else:
+                clips.append(create_chunk_clip(renderer, fps))
     
-    pil_img = resize_image_for_video(pil_img, target_res, fit_method, bg_color)
-    
-    # Create temp file for the processed image to ensure MoviePy compatibility
-    # (MoviePy sometimes struggles with direct PIL objects in complex compositions)
-    temp_img_path = os.path.join(temp_dir, f"processed_{os.path.basename(image_path)}")
-    pil_img.save(temp_img_path)
-    
-    clip = ImageClip(temp_img_path).set_duration(duration)
+    final_clip = concatenate_videoclips(clips, method="compose")
     
-    # Apply Text Overlay
-    if text_overlay and text_overlay.get('text'):
-        txt_img = create_text_image(
-            text_overlay['text'],
-            text_overlay.get('fontsize', 50),
-            text_overlay.get('color', 'white'),
-            image_size=target_res,
-            align=text_overlay.get('align', 'center')
+    # Add Audio
+    audio_path = None
+    if audio_config.get('path'):
+        audio_path = prepare_audio_track(audio_config, final_clip.duration)
+        if audio_path:
+            final_clip = final_clip.set_audio(AudioFileClip(audio_path))
+
+    # Write file
+    encoder = resolve_encoder(settings)
+    try:
+        # (compositing and x264 run interleaved here, so they share one span)
+        with span('compose.write_videofile', profile=encoder['profile']):
+            final_clip.write_videofile(
+                output_path,
+                fps=fps,
+                codec='libx264',
+                audio_codec='aac',
+                preset=encoder['preset'],
+                threads=encoder['threads'],
+                ffmpeg_params=x264_params(encoder, fps)
+            )
+    finally:
+        if audio_path:
+            release_audio_track(audio_path)
+
+def _encode_chunk_segment(images, chunk, renderer, settings, seg_path, temp_dir, encoder):
+    """Encodes one timeline chunk into seg_path (written under a temp name, then moved into place)."""
+    fps = settings.get('fps', 30)
+    tmp_path = os.path.join(temp_dir, "encoding_" + os.path.basename(seg_path))
+    source = os.path.basename(images[chunk['slides'][0]]['path'])
+
+    still = still_frames(images, chunk)
+
+    def stream(frames, path):
+        # Transitions and Ken Burns moves are streamed frame by frame with matching encoder parameters
+        encode_frame_stream(
+            (renderer.frame(k) for k in frames),
+            path,
+            settings.get('resolution', (1080, 1920)),
+            fps,
+            encoder,
+            prefetch=settings.get('prefetch_frames', 8)
         )
-        txt_clip = ImageClip(np.array(txt_img)).set_duration(duration)
-        clip = CompositeVideoClip([clip, txt_clip])
 
-    # Apply Transitions (simulated by simple effects for now, complex crossfades done in concat)
-    # Note: Crossfade transitions usually handled at checking time
-    
-    return clip
+    if still == renderer.frames:
+        with span('encode_segment', 'encode', path=source, static=True):
+            encode_still_segment(renderer.frame(0), still / fps, fps, tmp_path, encoder)
+    elif still:
+        # A still slide leaving through a transition: its still part is sent to
+        # ffmpeg once and only the blended frames are streamed, then both are
+        # joined into the chunk's segment
+        part_dir = os.path.join(temp_dir, "parts_" + os.path.splitext(os.path.basename(seg_path))[0])
+        os.makedirs(part_dir, exist_ok=True)
+        parts = [os.path.join(part_dir, "still.mp4"), os.path.join(part_dir, "blend.mp4")]
+        with span('encode_segment', 'encode', path=source, static=True, streamed=renderer.frames - still):
+            encode_still_segment(renderer.frame(0), still / fps, fps, parts[0], encoder)
+            stream(range(still, renderer.frames), parts[1])
+            concat_segments(parts, tmp_path, part_dir)
+        shutil.rmtree(part_dir, ignore_errors=True)
+    else:
+        with span('encode_segment', 'encode', path=source, static=False, frames=renderer.frames):
+            stream(range(renderer.frames), tmp_path)
+    os.replace(tmp_path, seg_path)
+
+def _render_segments(images, settings, audio_config, output_path, temp_dir, progress_callback, executor=None):
+    """
+    Encodes the timeline as one segment per slide (transitions.plan_chunks)
+    and joins them with a stream copy. Static slides are sent to ffmpeg as a
+    single frame, so render time scales with the number of slides rather than
+    the number of output frames; a transition is encoded with the slide it
+    leaves, blending only the overlapping frames.
+
+    Up to settings['encode_jobs'] segments (default: segment_encoder.default_encode_jobs)
+    are encoded at once by separate ffmpeg processes, with the cores split
+    between them, while the process pool keeps preparing the next slides.
+
+    Segments are keyed by each slide's effective parameters and kept in
+    settings['segment_dir'] (a throwaway directory when unset): a re-export
+    only prepares and encodes segments whose key changed, and audio is muxed
+    once onto the joined video.
+    """
+    store = SegmentStore(settings.get('segment_dir') or os.path.join(temp_dir, "segments"))
+    with span('segment_plan'):
+        slots, total_frames = plan_timeline(images, settings.get('fps', 30))
+        chunks = plan_chunks(images, slots)
+        # Thread count does not change the bitstream, so keys do not depend on encode_jobs
+        identity = encoder_identity(resolve_encoder(settings))
+        slide_keys = [segment_key(img_data, settings, identity) for img_data in images]
+        keys = [chunk_key([slide_keys[idx] for idx in chunk['slides']], chunk['offset'], chunk['overlap'])
+                for chunk in chunks]
+        plan = store.diff(keys)
+
+    # Identical segments are shared; encode each missing key once
+    to_encode = list({keys[pos]: pos for pos in reversed(plan['encode'])}.values())[::-1]
+    todo = [chunks[pos] for pos in to_encode]
+    jobs = max(1, min(settings.get('encode_jobs') or default_encode_jobs(), len(todo)))
+    encoder = resolve_encoder(settings, concurrent=jobs)
+
+    # Preparation (pool) and encoding each drive half of the progress bar
+    prepared = [0.0]
+    encoded = [0]
+    cache_stats = {'hits': 0, 'misses': 0}
+    def report():
+        if progress_callback and todo:
+            progress_callback(0.5 * prepared[0] + 0.5 * encoded[0] / len(todo))
+
+    def prep_progress(p):
+        prepared[0] = p
+        report()
+
+    def collect(futures):
+        # Results (and progress callbacks) are handled on this thread
+        for future in futures:
+            future.result()
+            encoded[0] += 1
+        if futures:
+            report()
+
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="segment-encoder") as encoders:
+        pending = set()
+        try:
+            for pos, (chunk, renderer) in enumerate(iter_chunk_renderers(images, settings, todo, prep_progress, executor,
+                                                                                      cache_stats)):
+                seg_path = store.segment_path(keys[to_encode[pos]])
+                # Each encode runs in a copy of this context so its profiling spans are kept
+                pending.add(encoders.submit(contextvars.copy_context().run, _encode_chunk_segment,
+                                            images, chunk, renderer, settings, seg_path, temp_dir, encoder))
+                # Chunks waiting for an encoder hold their slides' frames; keep at most one per encoder waiting
+                if len(pending) >= 2 * jobs:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                else:
+                    done = {f for f in pending if f.done()}
+                    pending -= done
+                collect(done)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    video_path = store.video_path(keys)
+    if not os.path.exists(video_path):
+        tmp_video = os.path.join(temp_dir, "video_only.mp4")
+        with span('concat', 'encode', segments=len(keys)):
+            concat_segments([store.segment_path(k) for k in keys], tmp_video, temp_dir)
+        os.replace(tmp_video, video_path)
 
-def render_video(project_data, output_path, progress_callback=None):
+    store.commit(keys, {
+        'encoded': len(to_encode),
+        'reused': len(plan['reuse']),
+        'changed': plan['changed'],
+        'encode_jobs': jobs,
+        'frame_cache': cache_stats,
+    })
+
+    _finish_with_audio(video_path, total_frames / settings.get('fps', 30), audio_config, output_path)
+
+def _finish_with_audio(video_path, video_duration, audio_config, output_path):
+    """
+    Muxes the background music onto an encoded video of video_duration seconds
+    (or just copies it when there is none). The music bed comes from the audio
+    cache as a ready WAV.
+    """
+    audio_path = None
+    if audio_config.get('path'):
+        audio_path = prepare_audio_track(audio_config, video_duration)
+    if not audio_path:
+        with span('copy_output'):
+            shutil.copyfile(video_path, output_path)
+        return
+
+    try:
+        with span('audio.mux', 'audio'):
+            mux_audio(video_path, audio_path, output_path)
+    finally:
+        release_audio_track(audio_path)
+
+def _render_stream(images, settings, audio_config, output_path, temp_dir, progress_callback, executor=None):
+    """
+    Single-pass renderer: frames are produced lazily, chunk by chunk, and
+    piped straight into one ffmpeg process through a bounded prefetch queue
+    (settings['prefetch_frames']). Peak memory does not grow with slide count.
+    """
+    fps = settings.get('fps', 30)
+    size = settings.get('resolution', (1080, 1920))
+    slots, total_frames = plan_timeline(images, fps)
+
+    def frames():
+        # Runs on the producer thread; slide preparation still uses the process pool
+        for _, renderer in iter_chunk_renderers(images, settings, plan_chunks(images, slots), executor=executor):
+            yield from renderer
+
+    def frame_progress(n):
+        if progress_callback:
+            progress_callback(n / total_frames)
+
+    video_path = os.path.join(temp_dir, "video_only.mp4")
+    encoder = resolve_encoder(settings)
+    with span('encode_stream', 'encode', frames=total_frames, profile=encoder['profile']):
+        encode_frame_stream(
+            frames(), video_path, size, fps,
+            encoder,
+            prefetch=settings.get('prefetch_frames', 8),
+            frame_callback=frame_progress
+        )
+    _finish_with_audio(video_path, total_frames / fps, audio_config, output_path)
+
+def render_video(project_data, output_path, progress_callback=None, executor=None):
     """
     Main function to render video.
     project_data: dict containing 'images', 'audio', 'settings'
+    settings['render_mode']: 'segments' (default, per-slide encode + stream copy),
+                             'stream' (lazy frames piped into one ffmpeg process)
+                             or 'compose' (single MoviePy composition)
+    settings['segment_dir']: keep encoded segments here so re-exports only
+                             encode changed slides (segments mode)
+    settings['encode_jobs']: segments encoded concurrently (segments mode;
+                             default one ffmpeg per two cores)
+    settings['encoder_profile']: 'draft', 'social' (default) or 'archive'
+                                 (see segment_encoder.ENCODER_PROFILES)
+    settings['profile']: record timing spans for every stage and write them
+                         as a Chrome trace next to the output (see profiling.py)
+    executor: process pool to prepare slides on, so batch renders can share
+              one pool instead of starting one per video
     """
     settings = project_data.get('settings', {})
     images = project_data.get('images', [])
@@ -94,59 +389,24 @@ def render_video(project_data, output_path, progress_callback=None):
     if not images:
         return "No images to render"
 
-    clips = []
-    
-    with tempfile.TemporaryDirectory() as temp_dir:
-        for idx, img_data in enumerate(images):
-            clip = create_clip_from_data(img_data, settings, temp_dir)
-            
-            # Apply transition into this clip if specified (e.g., crossfadein)
-            # This is simplified; robust transition systems usually involve overlapping clips.
-            # here we just append.
-            clips.append(clip)
-            
-            if progress_callback:
-                progress_callback((idx + 1) / len(images) * 0.5) # 50% for clip creation
-        
-        final_clip = concatenate_videoclips(clips, method="compose")
-        
-        # Add Audio
-        if audio_config.get('path'):
-            audio = AudioFileClip(audio_config['path'])
-            
-            # Trim audio
-            start = audio_config.get('start_time', 0)
-            end = audio_config.get('end_time')
-            if end:
-                audio = audio.subclip(start, end)
-            else:
-                audio = audio.subclip(start) # to end
-            
-            # Loop audio if video is longer
-            if audio.duration < final_clip.duration and audio_config.get('loop'):
-                audio = audio.fx(vfx.audio_loop, duration=final_clip.duration)
-            
-            # Adjust volume
-            audio = audio.volumex(audio_config.get('volume', 1.0))
-            
-            # Set audio
-            final_clip = final_clip.set_audio(audio)
-            # If audio is shorter than video and no loop, set_audio cuts the video? 
-            # No, set_audio just sets it. But we should check duration.
-            if audio.duration > final_clip.duration:
-                 final_clip = final_clip.set_audio(audio.subclip(0, final_clip.duration))
-
-        # Write file
-        fps = settings.get('fps', 30)
-        # Using ultrafast preset for speed as requested
-        final_clip.write_videofile(
-            output_path, 
-            fps=fps, 
-            codec='libx264', 
-            audio_codec='aac',
-            preset='ultrafast',
-            threads=4
-        )
-        
+    if settings.get('profile'):
+        profiler = Profiler()
+        try:
+            with profiler.activate():
+                _render(images, settings, audio_config, output_path, progress_callback, executor)
+        finally:
+            # Partial traces of failed or cancelled renders are the interesting ones too
+            profiler.save(trace_path_for(output_path))
+    else:
+        _render(images, settings, audio_config, output_path, progress_callback, executor)
     return output_path
 
+def _render(images, settings, audio_config, output_path, progress_callback, executor):
+    render_mode = settings.get('render_mode', 'segments')
+    with span('render_video', mode=render_mode, slides=len(images)), tempfile.TemporaryDirectory() as temp_dir:
+        if render_mode == 'compose':
+            _render_compose(images, settings, audio_config, output_path, temp_dir, progress_callback, executor)
+        elif render_mode == 'stream':
+            _render_stream(images, settings, audio_config, output_path, temp_dir, progress_callback, executor)
+        else:
+            _render_segments(images, settings, audio_config, output_path, temp_dir, progress_callback, executor)
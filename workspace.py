@@ -0,0 +1,291 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_WORKSPACE_ROOT = os.path.join(tempfile.gettempdir(), "reel_editor_cache", "sessions")
+DEFAULT_SESSION_QUOTA = 2 * 1024 ** 3 # 2 GB of uploads, proxies, segments and renders per session
+DEFAULT_SESSION_TTL = 12 * 3600 # seconds a session may sit idle before its files are swept
+TOUCH_INTERVAL = 60 # seconds between last_seen writes
+SWEEP_INTERVAL = 600 # seconds between sweeps of abandoned sessions (per process)
+USAGE_REFRESH = 5 # seconds disk usage figures are reused before the directories are walked again
+TEMP_GRACE = 600 # seconds a .tmp file may be in the middle of being written; older ones are leftovers
+
+AREAS = ('uploads', 'derived', 'segments', 'renders')
+STATE_NAME = "session.json"
+
+class QuotaExceeded(IOError):
+    """Raised when a session would grow past its disk quota."""
+
+def dir_size(path):
+    """Total size of the files under path (0 if it does not exist)."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+_sizes = {}
+_sizes_lock = threading.Lock()
+
+def cached_dir_size(path, max_age=USAGE_REFRESH):
+    """dir_size, walked at most every max_age seconds per path (for large shared caches)."""
+    with _sizes_lock:
+        cached = _sizes.get(path)
+    if cached and time.time() - cached[0] < max_age:
+        return cached[1]
+    size = dir_size(path)
+    with _sizes_lock:
+        _sizes[path] = (time.time(), size)
+    return size
+
+def _clear_dir(path):
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+class Workspace:
+    """
+    One session's files under root/<session_id>:
+        uploads/  content-addressed uploads (blob_store.BlobStore)
+        derived/  ingest thumbnails, proxies and media sidecars
+        segments/ the session's segment store
+        renders/  rendered reels and their traces
+
+    Uploads and renders are reference counted: every owner ('timeline',
+    'audio', 'job:<id>', 'result', ...) declares the files it uses with
+    set_refs() (or add_ref() for one file), and collect() deletes the ones no
+    owner references any more, together with the derived files of deleted
+    uploads. Refs and the time the session was last seen are kept in
+    session.json for sweep_sessions().
+
+    usage() is reused for USAGE_REFRESH seconds unless the workspace changed
+    through this object (refs, collect, ensure_space).
+    """
+
+    def __init__(self, root, session_id, quota=DEFAULT_SESSION_QUOTA):
+        self.session_id = session_id
+        self.dir = os.path.join(root, session_id)
+        self.quota = quota
+        self._lock = threading.Lock()
+        state = self._load()
+        self.created = state.get('created', time.time())
+        self.last_seen = time.time()
+        self.refs = {rel: set(owners) for rel, owners in state.get('refs', {}).items()}
+        self._usage = None
+        self._usage_time = 0.0
+        self._ensure_dirs()
+        self._save()
+
+    def path(self, area):
+        """Directory of one area ('uploads', 'derived', 'segments' or 'renders')."""
+        return os.path.join(self.dir, area)
+
+    def _ensure_dirs(self):
+        for area in AREAS:
+            os.makedirs(self.path(area), exist_ok=True)
+
+    # --- persistence ---
+    def _load(self):
+        try:
+            with open(os.path.join(self.dir, STATE_NAME)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self):
+        state = {
+            'session_id': self.session_id,
+            'created': self.created,
+            'last_seen': self.last_seen,
+            'refs': {rel: sorted(owners) for rel, owners in self.refs.items()},
+        }
+        os.makedirs(self.dir, exist_ok=True)
+        tmp_path = os.path.join(self.dir, STATE_NAME + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(self.dir, STATE_NAME))
+
+    def touch(self):
+        """Marks the session as alive (written at most once per TOUCH_INTERVAL); recreates swept directories."""
+        if not os.path.isdir(self.dir):
+            self._ensure_dirs()
+        elif time.time() - self.last_seen < TOUCH_INTERVAL:
+            return
+        with self._lock:
+            self.last_seen = time.time()
+            self._save()
+
+    # --- references ---
+    def _rel(self, path):
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.dir))
+        return None if rel.startswith(os.pardir) else rel
+
+    def set_refs(self, owner, paths):
+        """Makes owner reference exactly `paths`; paths outside the workspace are ignored."""
+        wanted = {rel for rel in (self._rel(p) for p in paths if p) if rel}
+        with self._lock:
+            changed = False
+            for rel in list(self.refs):
+                owners = self.refs[rel]
+                if owner in owners and rel not in wanted:
+                    owners.discard(owner)
+                    changed = True
+                    if not owners:
+                        del self.refs[rel]
+            for rel in wanted:
+                owners = self.refs.setdefault(rel, set())
+                if owner not in owners:
+                    owners.add(owner)
+                    changed = True
+            if changed:
+                self._usage = None
+                self._save()
+
+    def add_ref(self, owner, path):
+        """Adds one file to owner's references, e.g. an upload as soon as it is stored."""
+        rel = self._rel(path)
+        if not rel:
+            return
+        with self._lock:
+            self._usage = None
+            owners = self.refs.setdefault(rel, set())
+            if owner not in owners:
+                owners.add(owner)
+                self._save()
+
+    def release(self, owner):
+        """Drops every reference held by owner."""
+        self.set_refs(owner, [])
+
+    def owners(self):
+        with self._lock:
+            return set().union(*self.refs.values()) if self.refs else set()
+
+    def refcount(self, path):
+        rel = self._rel(path)
+        with self._lock:
+            return len(self.refs.get(rel, ()))
+
+    def collect(self):
+        """
+        Deletes unreferenced uploads and renders, then derived files whose
+        upload is gone, and temp files left behind by interrupted writes
+        (older than TEMP_GRACE). Returns the number of bytes freed.
+        """
+        freed = 0
+        with self._lock:
+            referenced = set(self.refs)
+        for area in ('uploads', 'renders'):
+            for entry in os.scandir(self.path(area)):
+                if entry.name.endswith(".tmp"):
+                    if self._stale(entry):
+                        freed += self._remove(entry)
+                elif os.path.join(area, entry.name) not in referenced:
+                    freed += self._remove(entry)
+
+        # Derived files are named by the first 16 hex digits of their upload's digest
+        live = {name[:16] for name in os.listdir(self.path('uploads')) if not name.endswith(".tmp")}
+        for entry in os.scandir(self.path('derived')):
+            if entry.name.endswith(".tmp"):
+                if self._stale(entry):
+                    freed += self._remove(entry)
+            elif entry.name[:16] not in live:
+                freed += self._remove(entry)
+        if freed:
+            self._usage = None
+        return freed
+
+    def _stale(self, entry):
+        try:
+            return time.time() - entry.stat().st_mtime > TEMP_GRACE
+        except FileNotFoundError:
+            return False
+
+    def _remove(self, entry):
+        try:
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            return size
+        except (FileNotFoundError, IsADirectoryError):
+            return 0
+
+    # --- quota ---
+    def usage(self, max_age=USAGE_REFRESH):
+        """Bytes used per area plus 'total' and 'quota', at most max_age seconds old."""
+        if self._usage is None or time.time() - self._usage_time >= max_age:
+            usage = {area: dir_size(self.path(area)) for area in AREAS}
+            usage['total'] = sum(usage.values())
+            self._usage = usage
+            self._usage_time = time.time()
+        return dict(self._usage, quota=self.quota)
+
+    def ensure_space(self, nbytes):
+        """
+        Makes room for nbytes more: collects garbage first, then drops the
+        segment cache (unless a render is using it). Raises QuotaExceeded if
+        the session still would not fit in its quota.
+        """
+        used = self.usage(max_age=0)['total']
+        if used + nbytes <= self.quota:
+            return
+        self.collect()
+        used = self.usage(max_age=0)['total']
+        if used + nbytes > self.quota and not any(o.startswith('job:') for o in self.owners()):
+            _clear_dir(self.path('segments'))
+            used = self.usage(max_age=0)['total']
+        if used + nbytes > self.quota:
+            raise QuotaExceeded(
+                f"Session storage is full ({used / 1024**2:.0f} MB of {self.quota / 1024**2:.0f} MB); "
+                f"remove some slides or old renders first."
+            )
+
+def _last_seen(session_dir):
+    try:
+        with open(os.path.join(session_dir, STATE_NAME)) as f:
+            return float(json.load(f)['last_seen'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return os.path.getmtime(session_dir)
+
+def sweep_sessions(root=DEFAULT_WORKSPACE_ROOT, ttl=DEFAULT_SESSION_TTL, keep=()):
+    """
+    Deletes the workspaces of sessions not seen for ttl seconds, except the
+    session ids in keep (e.g. owners of queued or running renders).
+    Returns the ids removed.
+    """
+    if not os.path.isdir(root):
+        return []
+    now = time.time()
+    removed = []
+    for entry in os.scandir(root):
+        if not entry.is_dir() or entry.name in keep:
+            continue
+        try:
+            idle = now - _last_seen(entry.path)
+        except FileNotFoundError:
+            continue
+        if idle > ttl:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed.append(entry.name)
+    return removed
+
+_last_sweep = [0.0]
+_sweep_lock = threading.Lock()
+
+def maybe_sweep(root=DEFAULT_WORKSPACE_ROOT, ttl=DEFAULT_SESSION_TTL, keep=()):
+    """sweep_sessions at most once per SWEEP_INTERVAL per process (every session calls this on load)."""
+    with _sweep_lock:
+        if time.time() - _last_sweep[0] < SWEEP_INTERVAL:
+            return []
+        _last_sweep[0] = time.time()
+    return sweep_sessions(root, ttl, keep)